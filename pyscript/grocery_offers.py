@@ -5,13 +5,28 @@ Hämtar veckans erbjudanden från matpriskollen.se för konfigurerade butiker
 och matchar dem mot din inköpslista.
 
 Services:
-  pyscript.grocery_refresh_offers()              – Uppdatera erbjudanden manuellt
+  pyscript.grocery_refresh_offers(force=True)    – Uppdatera erbjudanden manuellt (force=False: bara inaktuella)
   pyscript.grocery_find_stores(lat, lon, radius) – Hitta butiker nära en plats
   pyscript.grocery_find_stores(search="willys")  – Sök butiker på namn
+  pyscript.grocery_get_offer_matches(item=None)  – Alla rankade träffar (svar från service)
 
 Konfiguration:
   input_text.grocery_store_uuids    – UUIDs för valda butiker (kommaseparerade)
   input_boolean.grocery_offers_enabled – Aktivera/inaktivera modulen
+  input_number.grocery_offers_concurrency – Max antal butiker som hämtas parallellt
+  input_text.grocery_offer_categories  – Behåll bara dessa kategorier (kommaseparerade, tom = alla)
+  input_boolean.grocery_offers_fuzzy   – Fuzzy-matchning mot inköpslistan (stavfel, varianter)
+  input_number.grocery_offers_fuzzy_threshold – Min trigram-likhet för fuzzy-träff (0.5–0.95)
+
+Cache:
+  /config/grocery_offers_cache.json – erbjudanden + ETag/Last-Modified per butik.
+  Läses vid start (sensorer fylls direkt) och omvalideras med villkorliga GET (304).
+  /config/grocery_offer_history.db  – prishistorik (SQLite), ger "lägsta på N veckor".
+  /config/grocery_store_search_cache.json – butikssök (per söktext / geo-ruta, 24 h).
+
+Schemaläggning:
+  Var 30:e minut hämtas bara butiker vars cache är inaktuell (TTL anpassas efter hur
+  ofta butikens erbjudanden ändras, 6–24 h, eller när erbjudandena gått ut).
 
 Hur du hittar en butiks UUID:
   1. Gå till matpriskollen.se och välj din butik
@@ -24,12 +39,53 @@ Hur du hittar en butiks UUID:
 import json
 import pathlib
 
+import grocery_http
+
 OFFERS_API = "https://matpriskollen.se/api/v1/stores"
 SHOPPING_LIST_FILE = "/config/.shopping_list.json"
-
-# Modul-nivå cache: uuid → {name, chain, offers: [...], fetched_at}
+OFFERS_CACHE_FILE  = "/config/grocery_offers_cache.json"
+HISTORY_DB_FILE    = "/config/grocery_offer_history.db"
+STORE_SEARCH_FILE  = "/config/grocery_store_search_cache.json"
+
+# Prishistorik: observationer äldre än så här rensas, och "lägsta på N veckor"
+# visas i notisen först från denna gräns
+HISTORY_RETENTION_DAYS   = 730
+HISTORY_LOWEST_MIN_WEEKS = 4
+
+# Max antal butiker som hämtas parallellt (överstyrs av input_number.grocery_offers_concurrency)
+DEFAULT_CONCURRENCY = 4
+
+# Färskhetsstyrd schemaläggning per butik (se _scheduled_refresh)
+SCHEDULER_PERIOD_MIN = 30           # hur ofta färskheten kontrolleras
+SCHEDULER_SPREAD_S   = 120          # inaktuella butiker sprids ut över så här många sekunder
+STORE_TTL_DEFAULT    = 12 * 3600    # TTL utan ändringshistorik
+STORE_TTL_MIN        = 6 * 3600
+STORE_TTL_MAX        = 24 * 3600
+CHANGE_EWMA_ALPHA    = 0.3          # vikt för senaste intervallet mellan ändringar
+
+# Antal exempel på nya erbjudanden per butik i last_diff
+DIFF_SAMPLE = 5
+
+# Cache för butikssök (grocery_find_stores): nyckel = normaliserad söktext
+# eller lat/lon avrundat till STORE_SEARCH_GEO_DECIMALS (~1 km) + radie
+STORE_SEARCH_TTL          = 24 * 3600
+STORE_SEARCH_MAX          = 50
+STORE_SEARCH_GEO_DECIMALS = 2
+
+# Modul-nivå cache: uuid → {name, chain, offers: [...], fetched_at, fetched_ts, fetch_ms, stale,
+#                           offers_etag, offers_modified, info_etag, info_modified}
+# Sparas i OFFERS_CACHE_FILE och läses in vid start.
 _offers_cache = {}
 
+# Senaste refresh-körning: {"duration_ms", "durations": {butik: ms}, "failed": [butik]}
+_last_refresh = {}
+# Nycklar (item|butik|produkt|pris) för matchningar som redan notifierats
+_notified_matches = set()
+# Senaste matchning: återanvänds om vyer och inköpslista är oförändrade
+_last_match = {"key": None, "matched": [], "all": [], "store_rank": {}}
+# Butikssök: nyckel → {"ts", "used", "stores"}; laddas från STORE_SEARCH_FILE vid start
+_store_search_cache = {}
+
 # ─── Helpers ──────────────────────────────────────────────────────────────────
 
 def _sget(entity_id, default=None):
@@ -49,54 +105,571 @@ def _get_configured_uuids():
         return []
     return [u.strip() for u in raw.split(",") if u.strip() and len(u.strip()) > 10]
 
+# ─── HTTP: hastighetsbegränsning + omförsök ───────────────────────────────────
+# Delad med grocery_tracker.py, se pyscript/modules/grocery_http.py.
+
+_http_stats = grocery_http.new_stats()
+
+
+async def _http_get_json(url, timeout, headers=None):
+    return await grocery_http.get_json(url, timeout, headers, _http_stats, "GroceryOffers")
+
+
 # ─── API-anrop ────────────────────────────────────────────────────────────────
 
-async def _fetch_store_info(uuid):
-    """Hämta butiksinformation från Matpriskollen JSON API."""
-    import aiohttp
+async def _api_get(url, timeout, etag="", last_modified=""):
+    """GET mot Matpriskollen med villkorliga headers (If-None-Match/If-Modified-Since).
+
+    Returnerar {"status", "data", "etag", "last_modified"} – status 0 vid nätverksfel,
+    304 betyder att innehållet är oförändrat sedan förra hämtningen (data=None).
+    """
+    headers = {
+        "Accept": "application/json",
+        "User-Agent": "Mozilla/5.0 (compatible; HomeAssistant)",
+    }
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    res = await _http_get_json(url, timeout, headers)
+    return {
+        "status":        res["status"],
+        "data":          res["data"],
+        "etag":          res["headers"].get("ETag", ""),            # skiftlägesokänslig
+        "last_modified": res["headers"].get("Last-Modified", ""),
+    }
+
+
+async def _fetch_store_info(uuid, etag="", last_modified=""):
+    """Hämta butiksinformation från Matpriskollen JSON API (villkorlig GET)."""
     try:
-        headers = {
-            "Accept": "application/json",
-            "User-Agent": "Mozilla/5.0 (compatible; HomeAssistant)",
-        }
-        async with aiohttp.ClientSession() as sess:
-            async with sess.get(
-                f"{OFFERS_API}/{uuid}",
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=10),
-            ) as resp:
-                if resp.status == 200:
-                    return await resp.json(content_type=None)
-                log.warning(f"[GroceryOffers] Butiksinfo HTTP {resp.status} för {uuid[:8]}...")
+        res = await _api_get(f"{OFFERS_API}/{uuid}", 10, etag, last_modified)
+        if res["status"] not in (200, 304):
+            log.warning(f"[GroceryOffers] Butiksinfo HTTP {res['status']} för {uuid[:8]}...")
+        return res
     except Exception as e:
         log.warning(f"[GroceryOffers] Butiksinfo-fel {uuid[:8]}...: {e}")
-    return None
+    return {"status": 0, "data": None, "etag": "", "last_modified": ""}
 
 
-async def _fetch_store_offers(uuid):
-    """Hämta erbjudanden för en butik."""
-    import aiohttp
+async def _fetch_store_offers(uuid, etag="", last_modified=""):
+    """Hämta erbjudanden för en butik (villkorlig GET). data = lista med erbjudanden vid 200."""
     try:
-        headers = {
-            "Accept": "application/json",
-            "User-Agent": "Mozilla/5.0 (compatible; HomeAssistant)",
-        }
-        async with aiohttp.ClientSession() as sess:
-            async with sess.get(
-                f"{OFFERS_API}/{uuid}/offers",
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=15),
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json(content_type=None)
-                    return data.get("offers", [])
-                log.warning(f"[GroceryOffers] Offers HTTP {resp.status} för {uuid[:8]}...")
+        res = await _api_get(f"{OFFERS_API}/{uuid}/offers", 15, etag, last_modified)
+        if res["status"] == 200:
+            res["data"] = (res["data"] or {}).get("offers", [])
+        elif res["status"] != 304:
+            log.warning(f"[GroceryOffers] Offers HTTP {res['status']} för {uuid[:8]}...")
+        return res
     except Exception as e:
         log.warning(f"[GroceryOffers] Offers-fel {uuid[:8]}...: {e}")
-    return []
+    return {"status": 0, "data": None, "etag": "", "last_modified": ""}
+
+
+def _get_concurrency():
+    """Max antal butiker som hämtas samtidigt (input_number.grocery_offers_concurrency)."""
+    try:
+        return max(1, int(float(_sget("input_number.grocery_offers_concurrency", DEFAULT_CONCURRENCY))))
+    except (ValueError, TypeError):
+        return DEFAULT_CONCURRENCY
+
+
+async def _fetch_store(uuid, fallback_name=None):
+    """Hämta butiksinfo och erbjudanden parallellt och uppdatera cachen.
+
+    Skickar ETag/Last-Modified från förra hämtningen – ett 304-svar behåller
+    cachade erbjudanden utan att ladda ner listan igen.
+    Vid fel behålls senast lyckade data i _offers_cache[uuid] (markeras stale).
+    Innehållshashen jämförs med förra hämtningen – bara vid ändring räknas en
+    diff fram och vyerna markeras för ombyggnad.
+    Returnerar {"ok", "name", "offer_count", "fetch_ms", "not_modified", "changed", "diff"}.
+    """
+    import time
+    from datetime import datetime
+    prev = _offers_cache.get(uuid)
+    # Validatorer skickas bara om vi har något att falla tillbaka på vid 304
+    pv = prev or {}
+    if pv.get("cat_filter", "") != ",".join(sorted(_get_category_filter())):
+        # Ändrat kategorifilter → ladda ner hela listan igen (ingen 304)
+        pv = dict(pv, offers_etag="", offers_modified="")
+    t0 = time.monotonic()
+    info_task   = task.create(_fetch_store_info, uuid, pv.get("info_etag", ""), pv.get("info_modified", ""))
+    offers_task = task.create(_fetch_store_offers, uuid, pv.get("offers_etag", ""), pv.get("offers_modified", ""))
+    await task.wait({info_task, offers_task})
+    fetch_ms = int((time.monotonic() - t0) * 1000)
+
+    failed_res = {"status": 0, "data": None, "etag": "", "last_modified": ""}
+    info_res   = info_task.result() if not info_task.exception() else failed_res
+    offers_res = offers_task.result() if not offers_task.exception() else failed_res
+    info = info_res["data"] if info_res["status"] == 200 else None
+
+    cat_filter   = _get_category_filter()
+    filter_key   = ",".join(sorted(cat_filter))
+    not_modified = offers_res["status"] == 304 and prev is not None
+    raw_bytes    = pv.get("raw_bytes", 0)
+    offers_bytes = pv.get("bytes", 0)
+    valid_until  = pv.get("valid_until", "")
+    content_hash = pv.get("content_hash", "")
+    if not_modified:
+        offers = pv.get("offers", [])
+    elif offers_res["status"] == 200:
+        # Projicering + storleksmätning av rå JSON körs i executor (utanför event-loopen)
+        offers, raw_bytes, offers_bytes, valid_until, content_hash = await task.executor(
+            _ingest_offers, offers_res["data"], cat_filter
+        )
+    else:
+        offers = None
+
+    if offers is None or (not info and not prev and not fallback_name):
+        name = pv.get("name") or fallback_name or uuid[:8]
+        if prev:
+            prev["stale"]    = True
+            prev["fetch_ms"] = fetch_ms
+            log.warning(f"[GroceryOffers] {name}: hämtning misslyckades – behåller cache från {prev.get('fetched_at', '?')}")
+        else:
+            log.warning(f"[GroceryOffers] Hittade inte butik: {uuid[:8]}...")
+        return {
+            "ok": False, "name": name, "offer_count": len(pv.get("offers", [])),
+            "fetch_ms": fetch_ms, "not_modified": False, "changed": False, "diff": None,
+        }
+
+    # Färskhet: hur ofta ändras butikens erbjudanden? (EWMA av tid mellan ändringar)
+    now     = time.time()
+    changed = not not_modified and content_hash != pv.get("content_hash")
+    diff    = None
+    if changed:
+        diff = await task.executor(_diff_offers, pv.get("offers"), offers)
+    change_interval = pv.get("change_interval")
+    if changed and pv.get("changed_ts"):
+        interval = now - pv["changed_ts"]
+        change_interval = interval if not change_interval else (
+            (1 - CHANGE_EWMA_ALPHA) * change_interval + CHANGE_EWMA_ALPHA * interval
+        )
+
+    # Butiksinfo kan fallera (eller vara 304) medan erbjudanden lyckas – använd tidigare namn då
+    name  = info.get("name") if info else None
+    chain = info.get("chainName") if info else None
+    info_ok = info_res["status"] in (200, 304)
+    _offers_cache[uuid] = {
+        "name":            name or pv.get("name") or fallback_name or uuid[:8],
+        "chain":           chain if chain is not None else pv.get("chain", ""),
+        "offers":          offers,
+        "fetched_at":      datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "fetched_ts":      now,
+        "changed_ts":      now if changed or not pv.get("changed_ts") else pv["changed_ts"],
+        "change_interval": change_interval,
+        "valid_until":     valid_until,
+        "content_hash":    content_hash,
+        "fetch_ms":        fetch_ms,
+        "stale":           False,
+        "offers_etag":     offers_res["etag"] or pv.get("offers_etag", ""),
+        "offers_modified": offers_res["last_modified"] or pv.get("offers_modified", ""),
+        "info_etag":       (info_res["etag"] or pv.get("info_etag", "")) if info_ok else pv.get("info_etag", ""),
+        "info_modified":   (info_res["last_modified"] or pv.get("info_modified", "")) if info_ok else pv.get("info_modified", ""),
+        "cat_filter":      filter_key,
+        "raw_bytes":       raw_bytes,
+        "bytes":           offers_bytes,
+    }
+    entry = _offers_cache[uuid]
+    # Vyerna (platt tabell, kategorier, per-butik) beror bara på namn + erbjudanden
+    if changed or prev is None or entry["name"] != pv.get("name"):
+        _mark_cache_changed()
+    status_txt = "oförändrade (304)" if not_modified else "erbjudanden"
+    log.info(
+        f"[GroceryOffers] {entry['name']}: {len(offers)} {status_txt} ({fetch_ms} ms, "
+        f"minne {entry['bytes'] // 1024} kB, rå JSON {raw_bytes // 1024} kB)"
+    )
+    return {
+        "ok": True, "name": entry["name"], "offer_count": len(offers),
+        "fetch_ms": fetch_ms, "not_modified": not_modified, "changed": changed, "diff": diff,
+    }
+
+# ─── Kompakta erbjudandeposter ────────────────────────────────────────────────
+# Rå API-JSON (produkt, kategoriträd, bild-URL-mappar …) projiceras vid inläsning
+# till en tuple per erbjudande. Kategoristrängar interneras så att tusentals
+# erbjudanden delar samma strängobjekt.
+#   (namn, varumärke, pris, jämförpris, volym, kategori, underkategori, bild)
+#
+# Rena beräkningar (projicering, matchning, vyer, JSON) är @pyscript_compile –
+# native Python som körs via task.executor så att HA:s event-loop inte blockeras.
+O_NAME, O_BRAND, O_PRICE, O_COMPRICE, O_VOLUME, O_CAT, O_SUBCAT, O_IMAGE = range(8)
+
+
+def _get_category_filter():
+    """Normaliserade kategorinamn från input_text.grocery_offer_categories (tom = alla)."""
+    raw = _sget("input_text.grocery_offer_categories", "").strip()
+    if not raw or raw in ("unknown", "unavailable", "none"):
+        return set()
+    return {_normalize(c) for c in raw.split(",") if c.strip()}
+
+
+@pyscript_compile
+def _project_offer(offer):
+    """Projicera ett rått Matpriskollen-erbjudande till en kompakt tuple."""
+    import sys
+    prod = offer.get("product") or {}
+    cats = prod.get("categories") or []
+    if cats:
+        parent = cats[0].get("parent_category") or {}
+        cat    = parent.get("name") or cats[0].get("name") or "Övrigt"
+        subcat = cats[0].get("name") or ""
+    else:
+        cat, subcat = "Övrigt", ""
+    # Produktfälten interneras – samma produkt i flera butiker (samma kedja)
+    # delar strängobjekt, bara pris/jämförpris är unika per butik
+    return (
+        sys.intern(str(prod.get("name") or "")),
+        sys.intern(str(prod.get("brand") or "")),
+        str(offer.get("price") or ""),
+        str(offer.get("comprice") or ""),
+        sys.intern(str(offer.get("volume") or "")),
+        sys.intern(str(cat)),
+        sys.intern(str(subcat)),
+        sys.intern(str((offer.get("produkt_bild_urls") or {}).get("thumbnailUrl") or "")),
+    )
+
+
+@pyscript_compile
+def _offer_product(rec):
+    """Produktnyckel för en erbjudandepost – allt utom pris och jämförpris."""
+    return (rec[O_NAME], rec[O_BRAND], rec[O_VOLUME], rec[O_CAT], rec[O_SUBCAT], rec[O_IMAGE])
+
+
+@pyscript_compile
+def _project_offers(raw_offers, cat_filter=None):
+    """Projicera en lista råa erbjudanden, valfritt filtrerad på kategori (huvud- eller underkategori)."""
+    result = []
+    for o in raw_offers or []:
+        rec = _project_offer(o)
+        if cat_filter and _normalize(rec[O_CAT]) not in cat_filter and _normalize(rec[O_SUBCAT]) not in cat_filter:
+            continue
+        result.append(rec)
+    return result
+
+
+@pyscript_compile
+def _restore_offers(stored):
+    """Återskapa tuples ur JSON-listor (eller projicera råa dicts från äldre cacheformat)."""
+    import sys
+    result = []
+    for o in stored or []:
+        if isinstance(o, dict):
+            result.append(_project_offer(o))
+        elif len(o) == 8:
+            rec = list(o)
+            for field in (O_NAME, O_BRAND, O_VOLUME, O_CAT, O_SUBCAT, O_IMAGE):
+                rec[field] = sys.intern(rec[field])
+            result.append(tuple(rec))
+    return result
+
+
+@pyscript_compile
+def _approx_size(obj, seen=None):
+    """Ungefärlig minnesstorlek i bytes (rekursiv sys.getsizeof).
+
+    Med seen (set med id:n) räknas delade objekt – internerade produktsträngar –
+    bara en gång, så att summan över flera butiker speglar faktisk delning.
+    """
+    import sys
+    if seen is not None:
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _approx_size(k, seen) + _approx_size(v, seen)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            size += _approx_size(v, seen)
+    return size
+
+
+@pyscript_compile
+def _offers_valid_until(raw_offers):
+    """Senaste slutdatum (YYYY-MM-DD) bland erbjudandenas giltighetsfält, "" om inget finns.
+
+    Senaste, inte tidigaste: listan är inaktuell först när alla erbjudanden gått ut.
+    Ett enstaka kortlivat erbjudande ska inte göra butiken inaktuell resten av veckan.
+    """
+    latest = ""
+    for o in raw_offers or []:
+        for field in ("validTo", "valid_to", "validUntil", "endDate", "end_date", "dateTo"):
+            val = o.get(field) if isinstance(o, dict) else None
+            if val:
+                day = str(val)[:10]
+                if len(day) == 10 and day > latest:
+                    latest = day
+                break
+    return latest
+
+
+@pyscript_compile
+def _offers_hash(records):
+    """Innehållshash för en butiks projicerade erbjudanden (ändringsdetektering)."""
+    import hashlib
+    payload = json.dumps(records, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+@pyscript_compile
+def _diff_offers(old_records, new_records):
+    """Jämför två erbjudandelistor per produkt (namn, varumärke, volym).
+
+    Returnerar {"new", "ended", "price_changed", "new_names"} – new_names är
+    upp till DIFF_SAMPLE namn på nya erbjudanden.
+    """
+    old_prices = {}
+    for o in old_records or []:
+        old_prices[(o[O_NAME], o[O_BRAND], o[O_VOLUME])] = o[O_PRICE]
+    new_count = 0
+    price_changed = 0
+    new_names = []
+    seen = set()
+    for o in new_records or []:
+        key = (o[O_NAME], o[O_BRAND], o[O_VOLUME])
+        seen.add(key)
+        if key not in old_prices:
+            new_count += 1
+            if len(new_names) < DIFF_SAMPLE:
+                new_names.append(o[O_NAME])
+        elif old_prices[key] != o[O_PRICE]:
+            price_changed += 1
+    ended = 0
+    for key in old_prices:
+        if key not in seen:
+            ended += 1
+    return {"new": new_count, "ended": ended, "price_changed": price_changed, "new_names": new_names}
+
+
+@pyscript_compile
+def _ingest_offers(raw_offers, cat_filter):
+    """Projicera råa erbjudanden och mät minne före/efter.
+
+    Returnerar (poster, rå_bytes, bytes, giltig_till, innehållshash).
+    """
+    records = _project_offers(raw_offers, cat_filter)
+    return (
+        records, _approx_size(raw_offers), _approx_size(records),
+        _offers_valid_until(raw_offers), _offers_hash(records),
+    )
+
+
+@pyscript_compile
+def _write_json(path, data):
+    """Serialisera och skriv JSON i ett svep (körs via task.executor)."""
+    import json
+    import pathlib
+    pathlib.Path(path).write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+@pyscript_compile
+def _read_json(path):
+    """Läs och avserialisera JSON (körs via task.executor)."""
+    import json
+    import pathlib
+    return json.loads(pathlib.Path(path).read_text(encoding="utf-8"))
+
+# ─── Persistent cache ─────────────────────────────────────────────────────────
+# pyscript blockerar open() – fil-I/O via pathlib + task.executor (som grocery_tracker.py).
+
+async def _save_offers_cache():
+    """Spara _offers_cache till disk så att sensorer kan fyllas direkt vid omstart."""
+    # Grund kopia per butik – serialiseringen sker i en annan tråd
+    snapshot = {uuid: dict(entry) for uuid, entry in _offers_cache.items()}
+    try:
+        await task.executor(_write_json, OFFERS_CACHE_FILE, {
+            "version":  2,
+            "stores":   snapshot,
+            "notified": sorted(_notified_matches),
+        })
+    except Exception as e:
+        log.warning(f"[GroceryOffers] Kunde inte spara offers-cache: {e}")
+
+
+async def _load_offers_cache():
+    """Läs sparad cache från disk. Behåller bara butiker som fortfarande är konfigurerade."""
+    try:
+        data = await task.executor(_read_json, OFFERS_CACHE_FILE)
+    except Exception as e:
+        log.debug(f"[GroceryOffers] Ingen offers-cache att läsa: {e}")
+        return 0
+    configured = set(_get_configured_uuids())
+    for uuid, entry in (data.get("stores") or {}).items():
+        if uuid in configured and isinstance(entry, dict):
+            entry["offers"] = await task.executor(_restore_offers, entry.get("offers"))
+            entry["bytes"]  = await task.executor(_approx_size, entry["offers"])
+            if data.get("version", 1) < 2:
+                # Äldre cache med råa dicts – tvinga full hämtning nästa gång
+                entry["offers_etag"] = entry["offers_modified"] = ""
+            if not entry.get("content_hash"):
+                entry["content_hash"] = await task.executor(_offers_hash, entry["offers"])
+            _offers_cache[uuid] = entry
+    _notified_matches.update(data.get("notified") or [])
+    _mark_cache_changed()
+    return len(_offers_cache)
+
+# ─── Prishistorik ─────────────────────────────────────────────────────────────
+# Varje observerat pris sparas i SQLite (HISTORY_DB_FILE). Produkter och butiker
+# ordlistekodas till heltals-id och ett oförändrat pris förlänger bara senaste
+# raden (last_day) – en ny rad skrivs endast när priset ändras. Dagar lagras som
+# date.toordinal(), priser som öre per styck.
+
+_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS product (
+    id    INTEGER PRIMARY KEY,
+    key   TEXT NOT NULL UNIQUE,
+    name  TEXT,
+    brand TEXT
+);
+CREATE TABLE IF NOT EXISTS store (
+    id   INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL UNIQUE,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS obs (
+    product_id  INTEGER NOT NULL,
+    store_id    INTEGER NOT NULL,
+    first_day   INTEGER NOT NULL,
+    last_day    INTEGER NOT NULL,
+    price_ore   INTEGER,
+    comprice    TEXT,
+    PRIMARY KEY (product_id, store_id, first_day)
+) WITHOUT ROWID;
+-- Senaste rad per produkt i en butik (_history_record) utan helskanning av obs
+CREATE INDEX IF NOT EXISTS obs_store_latest ON obs (store_id, product_id, first_day);
+"""
+
+
+@pyscript_compile
+def _product_key(name, brand, volume):
+    """Stabil produktnyckel: normaliserat namn|varumärke|volym."""
+    return "|".join([_normalize(name), _normalize(brand), _normalize(volume)])
+
+
+@pyscript_compile
+def _parse_price(text):
+    """Tolka ett pris till kronor per styck: "29,90", "19:-", "2 för 35:-" → 17.5. None om okänt."""
+    import re
+    if not text:
+        return None
+    t = str(text).lower().replace(",", ".").replace(":-", "").replace(":", ".")
+    m = re.search(r"(\d+)\s*(?:st\s*)?(?:för|for)\s*(\d+(?:\.\d+)?)", t)
+    if m:
+        n = int(m.group(1))
+        return round(float(m.group(2)) / n, 2) if n else None
+    m = re.search(r"\d+(?:\.\d+)?", t)
+    return float(m.group(0)) if m else None
+
+
+@pyscript_compile
+def _history_record(db_path, stores, day, retention_days):
+    """Spara prisobservationer för [(uuid, butiksnamn, erbjudanden)] på dag `day`.
+
+    Returnerar {"inserted", "extended", "rows", "bytes"}.
+    """
+    import os
+    import sqlite3
+    con = sqlite3.connect(db_path, timeout=30)
+    inserted = extended = 0
+    try:
+        con.executescript(_HISTORY_SCHEMA)
+        for uuid, store_name, offers in stores:
+            con.execute("INSERT OR IGNORE INTO store (uuid, name) VALUES (?, ?)", (uuid, store_name))
+            store_id = con.execute("SELECT id FROM store WHERE uuid = ?", (uuid,)).fetchone()[0]
+            # Senaste observation per produkt i butiken – ett intervall i obs_store_latest.
+            # SQLite hämtar övriga kolumner från raden med MAX(first_day) i gruppen.
+            latest = {}
+            for pid, first_day, last_day, price_ore, comprice in con.execute(
+                "SELECT product_id, MAX(first_day), last_day, price_ore, comprice FROM obs "
+                "WHERE store_id = ? GROUP BY product_id", (store_id,)
+            ):
+                latest[pid] = (first_day, last_day, price_ore, comprice)
+            seen = set()
+            for o in offers:
+                key = _product_key(o[O_NAME], o[O_BRAND], o[O_VOLUME])
+                con.execute("INSERT OR IGNORE INTO product (key, name, brand) VALUES (?, ?, ?)",
+                            (key, o[O_NAME], o[O_BRAND]))
+                pid = con.execute("SELECT id FROM product WHERE key = ?", (key,)).fetchone()[0]
+                if pid in seen:
+                    continue
+                seen.add(pid)
+                price = _parse_price(o[O_PRICE])
+                price_ore = int(round(price * 100)) if price is not None else None
+                prev = latest.get(pid)
+                if prev and prev[2] == price_ore and prev[3] == o[O_COMPRICE]:
+                    if prev[1] != day:
+                        con.execute("UPDATE obs SET last_day = ? WHERE product_id = ? AND store_id = ? AND first_day = ?",
+                                    (day, pid, store_id, prev[0]))
+                        extended += 1
+                elif not prev or prev[0] != day:
+                    con.execute("INSERT INTO obs VALUES (?, ?, ?, ?, ?, ?)",
+                                (pid, store_id, day, day, price_ore, o[O_COMPRICE]))
+                    inserted += 1
+                else:
+                    # Priset ändrades samma dag – skriv över dagens rad
+                    con.execute("UPDATE obs SET price_ore = ?, comprice = ? WHERE product_id = ? AND store_id = ? AND first_day = ?",
+                                (price_ore, o[O_COMPRICE], pid, store_id, day))
+        con.execute("DELETE FROM obs WHERE last_day < ?", (day - retention_days,))
+        con.commit()
+        rows = con.execute("SELECT COUNT(*) FROM obs").fetchone()[0]
+    finally:
+        con.close()
+    return {"inserted": inserted, "extended": extended, "rows": rows, "bytes": os.path.getsize(db_path)}
+
+
+@pyscript_compile
+def _history_annotate(db_path, matched, day):
+    """Sätt "lowest_weeks" på matchade erbjudanden: antal veckor sedan produkten senast
+    var billigare (i någon butik), eller hela historikens längd om den aldrig varit det."""
+    import os
+    import sqlite3
+    if not os.path.exists(db_path):
+        return matched
+    con = sqlite3.connect(db_path, timeout=30)
+    try:
+        for m in matched:
+            for offer in m["offers"]:
+                price = _parse_price(offer.get("price"))
+                if price is None:
+                    continue
+                key = _product_key(offer.get("product", ""), offer.get("brand", ""), offer.get("volume", ""))
+                row = con.execute("SELECT id FROM product WHERE key = ?", (key,)).fetchone()
+                if not row:
+                    continue
+                cheaper, first = con.execute(
+                    "SELECT MAX(CASE WHEN price_ore < ? THEN last_day END), MIN(first_day) "
+                    "FROM obs WHERE product_id = ?", (int(round(price * 100)), row[0])
+                ).fetchone()
+                since = cheaper if cheaper is not None else first
+                if since is not None:
+                    offer["lowest_weeks"] = max(0, (day - since) // 7)
+    finally:
+        con.close()
+    return matched
+
+
+async def _record_history(uuids):
+    """Spara senaste priser för givna butiker i prishistoriken (via executor)."""
+    from datetime import date
+    stores = []
+    for uuid in uuids:
+        entry = _offers_cache.get(uuid)
+        if entry and not entry.get("stale"):
+            stores.append((uuid, entry.get("name", uuid[:8]), entry.get("offers", [])))
+    if not stores:
+        return {}
+    try:
+        return await task.executor(
+            _history_record, HISTORY_DB_FILE, stores, date.today().toordinal(), HISTORY_RETENTION_DAYS
+        )
+    except Exception as e:
+        log.warning(f"[GroceryOffers] Kunde inte spara prishistorik: {e}")
+        return {}
 
 # ─── Matchning mot inköpslista ────────────────────────────────────────────────
 
+@pyscript_compile
 def _normalize(text):
     """Normalisera text för jämförelse – lowercase, inga diakritiska tecken."""
     if not text:
@@ -122,6 +695,7 @@ async def _get_shopping_list_items():
         return []
 
 
+@pyscript_compile
 def _extract_keywords(text):
     """Extrahera sökbara nyckelord ur ett varunamn (min 3 tecken, ej siffror)."""
     norm = _normalize(text)
@@ -165,9 +739,12 @@ _STANDALONE_DISQUALIFIERS = {
 }
 
 
+@pyscript_compile
 def _match_item_to_offers(item_name, all_offers):
     """Hitta erbjudanden som matchar ett inköpslista-item.
 
+    all_offers: lista med (butiksnamn, erbjudande-tuple).
+
     - Filtrerar generiska deskriptorer (farsk, fryst, eko…) ur nyckelorden
     - Krav: ALLA återstående nyckelord måste matchas (AND-logik)
     - Varje nyckelord matchas som exakt ord, prefix ELLER suffix i ett sökt ord
@@ -181,12 +758,9 @@ def _match_item_to_offers(item_name, all_offers):
     keywords = filtered if filtered else all_kw
 
     matches = []
-    for offer in all_offers:
-        prod       = offer.get("product", {})
-        prod_name  = _normalize(prod.get("name", ""))
-        brand      = _normalize(prod.get("brand", ""))
+    for store_name, rec in all_offers:
         # Extrahera ord ur produktnamn + varumärke (hanterar sammansatta ord)
-        search_words = _extract_keywords(prod_name + " " + brand)
+        search_words = _extract_keywords(rec[O_NAME] + " " + rec[O_BRAND])
 
         # AND-logik: alla nyckelord måste hittas som exakt/prefix/suffix
         all_match = True
@@ -218,89 +792,414 @@ def _match_item_to_offers(item_name, all_offers):
                     break
 
         if all_match:
-            cats = prod.get("categories", [])
-            cat  = cats[0].get("name", "") if cats else ""
             matches.append({
-                "product":    prod.get("name", ""),
-                "brand":      prod.get("brand", ""),
-                "price":      offer.get("price", ""),
-                "comprice":   offer.get("comprice", ""),
-                "volume":     offer.get("volume", ""),
-                "store_name": offer.get("_store_name", ""),
-                "category":   cat,
-                "image":      (offer.get("produkt_bild_urls") or {}).get("thumbnailUrl", ""),
+                "product":    rec[O_NAME],
+                "brand":      rec[O_BRAND],
+                "price":      rec[O_PRICE],
+                "comprice":   rec[O_COMPRICE],
+                "volume":     rec[O_VOLUME],
+                "store_name": store_name,
+                "category":   rec[O_SUBCAT],
+                "image":      rec[O_IMAGE],
             })
     return matches
 
 
-def _build_per_store_data():
-    """Bygg per-butik offerdata för butiksvy i dashboarden."""
-    result = {}
-    for uuid, cache_entry in _offers_cache.items():
+# ─── Fuzzy-matchning (trigram-index) ──────────────────────────────────────────
+# Index byggs en gång per cacheversion (i _build_views) över unika produkter –
+# butiker i samma kedja har till stor del samma erbjudanden, så tokenisering
+# och kandidatmängder skalar med antal produkter i stället för butiker × produkter:
+#   product_rows[pid]  – index i views["flat"] där produkten förekommer
+#   product_words[pid] – sökord för produktens namn + varumärke
+#   words / vocab      – unika ord ↔ ord-id
+#   word_products      – ord-id → pid:n
+#   trigrams           – trigram → ord-id:n som innehåller det
+# Nyckelord matchas mot ordförrådet i stället för mot varje erbjudande, och
+# fuzzy-kandidater hittas via delade trigram (bara ord med tillräckligt många
+# gemensamma trigram jämförs). Samma regler som _match_item_to_offers gäller
+# fortfarande: _SKIP_WORDS, _COMPOUND_TYPE_PREFIXES och _STANDALONE_DISQUALIFIERS.
+
+DEFAULT_FUZZY_THRESHOLD = 0.6
+FUZZY_MIN_KEYWORD_LEN   = 4    # kortare nyckelord (ost, ris …) matchas bara exakt
+FUZZY_MAX_LEN_DIFF      = 3    # ord vars längd skiljer mer än så jämförs inte
+
+
+@pyscript_compile
+def _trigrams(word):
+    """Trigram för ett ord, med ordgränser markerade ($ord$)."""
+    padded = "$" + word + "$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@pyscript_compile
+def _build_match_index(flat):
+    """Bygg sökindex över flat = [(butiksnamn, erbjudande)] (se ovan)."""
+    product_ids   = {}
+    product_rows  = []
+    product_words = []
+    vocab         = {}
+    words         = []
+    word_products = []
+    trigrams      = {}
+    for i, (_store, rec) in enumerate(flat):
+        key = _offer_product(rec)
+        pid = product_ids.get(key)
+        if pid is None:
+            pid = len(product_rows)
+            product_ids[key] = pid
+            product_rows.append([])
+            ws = _extract_keywords(rec[O_NAME] + " " + rec[O_BRAND])
+            product_words.append(ws)
+            for w in set(ws):
+                wid = vocab.get(w)
+                if wid is None:
+                    wid = len(words)
+                    vocab[w] = wid
+                    words.append(w)
+                    word_products.append([])
+                    for tri in _trigrams(w):
+                        if tri not in trigrams:
+                            trigrams[tri] = []
+                        trigrams[tri].append(wid)
+                word_products[wid].append(pid)
+        product_rows[pid].append(i)
+    return {
+        "product_rows":  product_rows,
+        "product_words": product_words,
+        "vocab":         vocab,
+        "words":         words,
+        "word_products": word_products,
+        "trigrams":      trigrams,
+    }
+
+
+@pyscript_compile
+def _keyword_word_ids(kw, index, fuzzy, threshold):
+    """Ord-id:n i indexet som ett nyckelord träffar.
+
+    Exakt/prefix/suffix enligt samma regler som _match_item_to_offers; med fuzzy
+    även ord vars trigram-likhet (Dice) med nyckelordet är >= threshold.
+    """
+    hits = set()
+    for wid, sw in enumerate(index["words"]):
+        if sw == kw or sw.startswith(kw):
+            hits.add(wid)
+        elif sw.endswith(kw) and len(sw) > len(kw) and sw[:-len(kw)] not in _COMPOUND_TYPE_PREFIXES:
+            hits.add(wid)
+    if not fuzzy or len(kw) < FUZZY_MIN_KEYWORD_LEN:
+        return hits
+
+    kw_tris = _trigrams(kw)
+    # Kandidatgallring: räkna delade trigram via indexet, jämför bara de ord
+    # som kan nå tröskeln (Dice = 2·delade / (|A| + |B|))
+    shared = {}
+    for tri in kw_tris:
+        for wid in index["trigrams"].get(tri, ()):
+            shared[wid] = shared.get(wid, 0) + 1
+    min_shared = threshold * len(kw_tris) / 2
+    for wid, n in shared.items():
+        if n < min_shared or wid in hits:
+            continue
+        sw = index["words"][wid]
+        if abs(len(sw) - len(kw)) > FUZZY_MAX_LEN_DIFF:
+            continue
+        # Typändrande sammansättning måste finnas i båda eller inget av orden
+        # (mjolk ≠ kattmjolk, kattmjolk ≠ lattmjolk)
+        rejected = False
+        for prefix in _COMPOUND_TYPE_PREFIXES:
+            if sw.startswith(prefix) != kw.startswith(prefix):
+                rejected = True
+                break
+        if rejected:
+            continue
+        if 2.0 * n / (len(kw_tris) + len(_trigrams(sw))) >= threshold:
+            hits.add(wid)
+    return hits
+
+
+@pyscript_compile
+def _match_item_indexed(item_name, all_offers, index, fuzzy=False, threshold=DEFAULT_FUZZY_THRESHOLD):
+    """Som _match_item_to_offers men via förbyggt index (och valfri fuzzy-matchning)."""
+    all_kw = _extract_keywords(item_name)
+    if not all_kw:
+        return []
+    filtered = [kw for kw in all_kw if kw not in _SKIP_WORDS]
+    keywords = filtered if filtered else all_kw
+
+    # AND-logik: snitt av produktmängderna för varje nyckelord
+    candidates = None
+    for kw in keywords:
+        product_ids = set()
+        for wid in _keyword_word_ids(kw, index, fuzzy, threshold):
+            product_ids.update(index["word_products"][wid])
+        candidates = product_ids if candidates is None else candidates & product_ids
+        if not candidates:
+            return []
+
+    kw_set = set(keywords)
+    rows = []
+    for pid in candidates:
+        search_words = index["product_words"][pid]
+        disqualified = False
+        for dq in _STANDALONE_DISQUALIFIERS:
+            if dq in search_words and dq not in kw_set:
+                disqualified = True
+                break
+        if not disqualified:
+            rows.extend(index["product_rows"][pid])
+
+    matches = []
+    for i in sorted(rows):
+        store_name, rec = all_offers[i]
+        matches.append({
+            "product":    rec[O_NAME],
+            "brand":      rec[O_BRAND],
+            "price":      rec[O_PRICE],
+            "comprice":   rec[O_COMPRICE],
+            "volume":     rec[O_VOLUME],
+            "store_name": store_name,
+            "category":   rec[O_SUBCAT],
+            "image":      rec[O_IMAGE],
+        })
+    return matches
+
+
+@pyscript_compile
+def _match_shopping_list(item_names, all_offers, index=None, fuzzy=False, threshold=DEFAULT_FUZZY_THRESHOLD):
+    """Matcha alla inköpslista-namn mot erbjudanden (körs via task.executor).
+
+    Med index (från _build_match_index) matchas nyckelord mot ordförrådet i
+    stället för mot varje erbjudande; fuzzy kräver index.
+    """
+    matched = []
+    for item_name in item_names:
+        if index is not None:
+            offers_for_item = _match_item_indexed(item_name, all_offers, index, fuzzy, threshold)
+        else:
+            offers_for_item = _match_item_to_offers(item_name, all_offers)
+        if offers_for_item:
+            matched.append({"item": item_name, "offers": offers_for_item})
+    return matched
+
+
+# ─── Rankning av träffar ──────────────────────────────────────────────────────
+# Träffar per item sorteras på jämförpris, sedan pris, sedan butiksordning i
+# input_text.grocery_store_uuids (först = föredragen). Sensorn får bara de
+# MATCH_TOP_K bästa per item; hela listan hämtas via grocery_get_offer_matches.
+
+MATCH_TOP_K = 3
+
+
+@pyscript_compile
+def _rank_key(offer, store_rank):
+    """Sorteringsnyckel för ett matchat erbjudande – lägre är bättre, okänt pris sist."""
+    comprice = _parse_price(offer.get("comprice"))
+    price    = _parse_price(offer.get("price"))
+    return (
+        comprice if comprice is not None else float("inf"),
+        price if price is not None else float("inf"),
+        store_rank.get(offer.get("store_name"), len(store_rank)),
+    )
+
+
+@pyscript_compile
+def _rank_matches(matched, store_rank, top_k=None):
+    """Sortera varje items träffar; med top_k behålls bara de k bästa (begränsad heap).
+
+    Returnerar nya dicts {"item", "offers", "offer_count"} – indata ändras inte.
+    """
+    import heapq
+    ranked = []
+    for m in matched:
+        offers = m["offers"]
+        if top_k is None:
+            keyed = [(_rank_key(o, store_rank), i) for i, o in enumerate(offers)]
+            keyed.sort()
+        else:
+            # nsmallest håller en heap med högst k element – ingen full sortering
+            keyed = heapq.nsmallest(top_k, [(_rank_key(o, store_rank), i) for i, o in enumerate(offers)])
+        ranked.append({
+            "item":        m["item"],
+            "offers":      [offers[i] for _key, i in keyed],
+            "offer_count": len(offers),
+        })
+    return ranked
+
+
+def _get_store_rank():
+    """Butiksnamn → position i input_text.grocery_store_uuids (lägre = föredragen)."""
+    rank = {}
+    for pos, uuid in enumerate(_get_configured_uuids()):
+        entry = _offers_cache.get(uuid)
+        if entry:
+            rank[entry.get("name", uuid[:8])] = pos
+    return rank
+
+
+# ─── Härledda vyer ────────────────────────────────────────────────────────────
+# Platt erbjudandetabell, kategoriaggregat och per-butik-gruppering byggs i ett
+# enda svep över cachen och återanvänds tills cachen ändras igen
+# (_mark_cache_changed() anropas vid varje ändring av _offers_cache).
+
+CATEGORY_TOP_N  = 12   # antal kategorier i sensor.grocery_offers_detail
+CATEGORY_SAMPLE = 5    # exempel-erbjudanden per kategori
+STORE_CAT_TOP_N = 25   # erbjudanden per kategori i sensor.grocery_offers_store_view
+
+_cache_version = 0
+_views = {"version": -1}
+
+
+def _mark_cache_changed():
+    """Markera att _offers_cache ändrats – vyerna byggs om vid nästa _get_views()."""
+    global _cache_version
+    _cache_version += 1
+
+
+@pyscript_compile
+def _build_views(cache_items, version):
+    """Bygg alla härledda vyer i ett svep över cache_items = [(uuid, cache-post)]."""
+    flat       = []   # (butiksnamn, erbjudande) – underlag för matchning
+    stores     = []   # (uuid, butiksnamn) i cache-ordning
+    cat_agg    = {}   # kategori → [antal, exempel]
+    store_cats = {}   # butiksnamn → [{name, count, offers: topp-N}] – färdig för rendering
+    for uuid, cache_entry in cache_items:
         store_name = cache_entry.get("name", uuid[:8])
-        offers_data = []
+        stores.append((uuid, store_name))
+        groups = {}
         for o in cache_entry.get("offers", []):
-            prod = o.get("product", {})
-            cats = prod.get("categories", [])
-            if cats:
-                parent = cats[0].get("parent_category") or {}
-                cat_name = parent.get("name") or cats[0].get("name") or "Övrigt"
-            else:
-                cat_name = "Övrigt"
-            offers_data.append({
-                "n": prod.get("name", ""),
-                "b": prod.get("brand", ""),
-                "p": o.get("price", ""),
-                "c": cat_name,
-            })
-        result[store_name] = offers_data
-    return result
+            flat.append((store_name, o))
+            cat = o[O_CAT]
+            agg = cat_agg.get(cat)
+            if agg is None:
+                agg = [0, []]
+                cat_agg[cat] = agg
+            agg[0] += 1
+            if len(agg[1]) < CATEGORY_SAMPLE:
+                agg[1].append({"n": o[O_NAME], "b": o[O_BRAND], "p": o[O_PRICE], "s": store_name})
+            if cat not in groups:
+                groups[cat] = []
+            groups[cat].append(o)
+
+        store_groups = []
+        for cat, offers in sorted(groups.items(), key=lambda x: -len(x[1])):
+            rows = [{"n": o[O_NAME], "b": o[O_BRAND], "p": o[O_PRICE]} for o in offers[:STORE_CAT_TOP_N]]
+            store_groups.append({"name": cat, "count": len(offers), "offers": rows})
+        store_cats[store_name] = store_groups
+
+    categories = [
+        {"name": cat, "count": agg[0], "offers": agg[1]}
+        for cat, agg in sorted(cat_agg.items(), key=lambda x: -x[1][0])
+    ][:CATEGORY_TOP_N]
+    index = _build_match_index(flat)
+
+    return {
+        "version":    version,
+        "flat":       flat,
+        "stores":     stores,
+        "categories": categories,
+        "store_cats": store_cats,
+        "total":      len(flat),
+        "index":      index,
+        # Minne med delade produktsträngar räknade en gång (jfr summan av per-butik "bytes")
+        "bytes":      _approx_size([entry.get("offers", []) for _uuid, entry in cache_items], set()),
+    }
+
+
+async def _get_views():
+    """Returnera cachade vyer, bygg om (i executor) endast om _offers_cache ändrats sedan sist."""
+    global _views
+    if _views.get("version") != _cache_version:
+        _views = await task.executor(_build_views, list(_offers_cache.items()), _cache_version)
+    return _views
+
+_store_view_key = {"key": None}
+
+
+async def _publish_store_view(force=False):
+    """Publicera färdiggrupperade erbjudanden för butiken i input_text.grocery_view_store.
+
+    Bara vald butik publiceras (kategorier sorterade, topp STORE_CAT_TOP_N per
+    kategori) – dashboarden renderar attributen direkt utan egen gruppering.
+    """
+    selected = _sget("input_text.grocery_view_store", "") or ""
+    views = await _get_views()
+    key = (views["version"], selected)
+    if not force and _store_view_key["key"] == key:
+        return
+    sections = views["store_cats"].get(selected, []) if selected else []
+    total = sum([sec["count"] for sec in sections])
+    shown = sum([len(sec["offers"]) for sec in sections])
+    state.set("sensor.grocery_offers_store_view", total, {
+        "friendly_name": "Grocery – Erbjudanden i vald butik",
+        "icon":          "mdi:store-eye-outline",
+        "store":         selected,
+        "sections":      sections,
+        "shown":         shown,
+        "truncated":     shown < total,
+    })
+    _store_view_key["key"] = key
 
 
-def _build_category_data():
-    """Bygg kategoriserad offerdata från cache (för sensor-attribut)."""
-    cat_map = {}
-    for uuid, cache_entry in _offers_cache.items():
-        store_name = cache_entry.get("name", "?")
-        for offer in cache_entry.get("offers", []):
-            prod = offer.get("product", {})
-            cats = prod.get("categories", [])
-            if cats:
-                parent = cats[0].get("parent_category") or {}
-                cat_name = parent.get("name") or cats[0].get("name") or "Övrigt"
-            else:
-                cat_name = "Övrigt"
-            if cat_name not in cat_map:
-                cat_map[cat_name] = []
-            cat_map[cat_name].append({
-                "n": prod.get("name", ""),
-                "b": prod.get("brand", ""),
-                "p": offer.get("price", ""),
-                "s": store_name,
-            })
-    result = []
-    for name, offers in sorted(cat_map.items(), key=lambda x: -len(x[1])):
-        result.append({"name": name, "count": len(offers), "offers": offers[:5]})
-    return result[:12]
+@state_trigger("input_text.grocery_view_store")
+async def _view_store_changed(**kwargs):
+    await _publish_store_view()
 
 # ─── Uppdatera sensorer ───────────────────────────────────────────────────────
 
-def _update_count_sensor():
-    """Uppdatera sensor.grocery_offers_count och grocery_configured_picker."""
-    from datetime import datetime
-    total = sum([len(v.get("offers", [])) for v in _offers_cache.values()])
-    stores_summary = [
+def _stores_summary():
+    """Per-butik-sammanfattning för sensor.grocery_offers_count (färskhet, antal, namn)."""
+    return [
         {
             "uuid":        uuid,
             "name":        v.get("name", uuid[:8]),
             "chain":       v.get("chain", ""),
             "offer_count": len(v.get("offers", [])),
             "fetched_at":  v.get("fetched_at", ""),
+            "fetch_ms":    v.get("fetch_ms"),
+            "stale":       v.get("stale", False),
+            "due":         _is_store_stale(v),
+            "ttl_h":       round(_store_ttl(v) / 3600, 1),
+            "valid_until": v.get("valid_until", ""),
         }
         for uuid, v in _offers_cache.items()
     ]
-    # namn → uuid-mapping för remove-service
-    name_to_uuid = {v.get("name", uuid[:8]): uuid for uuid, v in _offers_cache.items()}
+
+
+def _name_to_uuid():
+    """namn → uuid-mapping för remove-service."""
+    return {v.get("name", uuid[:8]): uuid for uuid, v in _offers_cache.items()}
+
+
+# Senast publicerade alternativ i grocery_configured_picker – sätts bara om vid ändring
+_picker_options = {"options": None}
+
+
+def _update_store_picker(stores_summary, force=True):
+    """Uppdatera dropdown för remove (force=False: bara om namn/antal ändrats)."""
+    # Notera: placeholder ingår alltid i options-listan för att undvika "no longer valid"-varningar.
+    store_options = [f"{s['name']} ({s['offer_count']} reas)" for s in stores_summary]
+    all_options = ["– Inga butiker konfigurerade –"] + store_options
+    if not force and all_options == _picker_options["options"]:
+        return
+    _picker_options["options"] = all_options
+    input_select.set_options(
+        entity_id="input_select.grocery_configured_picker",
+        options=all_options,
+    )
+    if store_options:
+        input_select.select_option(
+            entity_id="input_select.grocery_configured_picker",
+            option=store_options[0],
+        )
+
+
+async def _update_count_sensor():
+    """Uppdatera sensor.grocery_offers_count och grocery_configured_picker."""
+    from datetime import datetime
+    views = await _get_views()
+    total = views["total"]
+    stores_summary = _stores_summary()
+    name_to_uuid = _name_to_uuid()
 
     state.set("sensor.grocery_offers_count", total, {
         "friendly_name": "Grocery – Erbjudanden totalt",
@@ -309,70 +1208,100 @@ def _update_count_sensor():
         "store_count":   len(stores_summary),
         "last_update":   datetime.now().strftime("%Y-%m-%d %H:%M"),
         "name_to_uuid":  name_to_uuid,
+        "refresh_ms":    _last_refresh.get("duration_ms"),
+        "fetch_ms":      _last_refresh.get("durations", {}),
+        "failed_stores": _last_refresh.get("failed", []),
+        "cache_kb":      sum([v.get("bytes", 0) for v in _offers_cache.values()]) // 1024,
+        "raw_json_kb":   sum([v.get("raw_bytes", 0) for v in _offers_cache.values()]) // 1024,
+        "shared_kb":     views["bytes"] // 1024,
+        "distinct_products": len(views["index"]["product_rows"]),
+        "history_rows":  _last_refresh.get("history", {}).get("rows"),
+        "history_kb":    (_last_refresh.get("history", {}).get("bytes") or 0) // 1024,
+        "last_diff":     _last_refresh.get("diff", {}),
+        "http":          dict(_http_stats),
     })
     # Stora data i eget sensor för att hålla grocery_offers_count under 16KB
     state.set("sensor.grocery_offers_detail", total, {
         "friendly_name": "Grocery – Erbjudandedetaljer",
         "icon":          "mdi:tag-multiple",
-        "categories":        _build_category_data(),
-        "per_store_offers":  _build_per_store_data(),
+        "categories":        views["categories"],
     })
+    await _publish_store_view()
+    _update_store_picker(stores_summary)
 
-    # Uppdatera dropdown för remove
-    # Notera: placeholder ingår alltid i options-listan för att undvika "no longer valid"-varningar.
-    if stores_summary:
-        store_options = [f"{s['name']} ({s['offer_count']} reas)" for s in stores_summary]
-        all_options = ["– Inga butiker konfigurerade –"] + store_options
-        input_select.set_options(
-            entity_id="input_select.grocery_configured_picker",
-            options=all_options,
-        )
-        input_select.select_option(
-            entity_id="input_select.grocery_configured_picker",
-            option=store_options[0],
-        )
-    else:
-        input_select.set_options(
-            entity_id="input_select.grocery_configured_picker",
-            options=["– Inga butiker konfigurerade –"],
-        )
+
+def _get_fuzzy_threshold():
+    """Min trigram-likhet för fuzzy-träff (input_number.grocery_offers_fuzzy_threshold)."""
+    try:
+        value = float(_sget("input_number.grocery_offers_fuzzy_threshold", DEFAULT_FUZZY_THRESHOLD))
+    except (ValueError, TypeError):
+        return DEFAULT_FUZZY_THRESHOLD
+    return min(0.95, max(0.5, value))
 
 
 async def _update_match_sensor():
-    """Matcha inköpslistan mot erbjudanden och uppdatera sensor."""
-    shopping_items = await _get_shopping_list_items()
+    """Matcha inköpslistan mot erbjudanden och uppdatera sensor.
 
-    # Samla alla erbjudanden med butiksnamn injekterat
-    all_offers = []
-    for uuid, cache_entry in _offers_cache.items():
-        for offer in cache_entry.get("offers", []):
-            offer["_store_name"] = cache_entry.get("name", uuid[:8])
-            all_offers.append(offer)
+    Hoppar över matchning och publicering om varken erbjudanden eller
+    inköpslistan ändrats sedan förra körningen.
+    """
+    shopping_items = await _get_shopping_list_items()
 
-    matched = []
+    # Platt tabell (butiksnamn, erbjudande) – byggs bara om när cachen ändrats
+    views = await _get_views()
+    item_names = []
     for item in shopping_items:
         item_name = item.get("summary", item.get("name", ""))
-        if not item_name:
-            continue
-        offers_for_item = _match_item_to_offers(item_name, all_offers)
-        if offers_for_item:
-            matched.append({
-                "item":   item_name,
-                "offers": offers_for_item,
-            })
+        if item_name:
+            item_names.append(item_name)
+
+    fuzzy     = _sbool("input_boolean.grocery_offers_fuzzy")
+    threshold = _get_fuzzy_threshold()
+    store_rank = _get_store_rank()
+    match_key  = (views["version"], tuple(item_names), fuzzy, threshold, tuple(sorted(store_rank.items())))
+    if _last_match["key"] == match_key:
+        return _last_match["matched"]
+
+    # Matchningen är ren CPU – körs i executor, resultatet används tillbaka på loopen.
+    # Sökindexet byggs tillsammans med vyerna och återanvänds tills cachen ändras.
+    all_matched = await task.executor(
+        _match_shopping_list, item_names, views["flat"], views["index"], fuzzy, threshold
+    )
+    # Sensorn får bara topp-k per item – håller attributen under HA:s storleksgräns
+    matched = await task.executor(_rank_matches, all_matched, store_rank, MATCH_TOP_K)
+    if matched:
+        from datetime import date
+        try:
+            matched = await task.executor(_history_annotate, HISTORY_DB_FILE, matched, date.today().toordinal())
+        except Exception as e:
+            log.warning(f"[GroceryOffers] Kunde inte läsa prishistorik: {e}")
 
     state.set("sensor.grocery_offers_matches", len(matched), {
         "friendly_name":          "Grocery – Reas som matchar inköpslistan",
         "icon":                   "mdi:tag-check",
         "matched_items":          matched,
         "shopping_items_checked": len(shopping_items),
+        "fuzzy":                  fuzzy,
     })
+    _last_match["key"]        = match_key
+    _last_match["matched"]    = matched
+    _last_match["all"]        = all_matched
+    _last_match["store_rank"] = store_rank
     return matched
 
+
+def _match_keys(m):
+    """Nycklar för ett matchat item – en per erbjudande (item|butik|produkt|pris)."""
+    return [f"{m['item']}|{o['store_name']}|{o['product']}|{o['price']}" for o in m["offers"]]
+
 # ─── Refresh-logik ────────────────────────────────────────────────────────────
 
-async def _do_refresh():
-    """Hämta erbjudanden för alla konfigurerade butiker och uppdatera sensorer."""
+async def _do_refresh(only=None, spread_s=0):
+    """Hämta erbjudanden och uppdatera sensorer.
+
+    only:     lista med butiks-UUIDs att hämta (None = alla konfigurerade)
+    spread_s: sprid starttiderna slumpmässigt över så många sekunder (jitter)
+    """
     uuids = _get_configured_uuids()
 
     if not uuids:
@@ -387,57 +1316,136 @@ async def _do_refresh():
         })
         return
 
-    from datetime import datetime
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M")
+    if only is not None:
+        uuids = [u for u in uuids if u in only]
+        if not uuids:
+            return
 
-    log.info(f"[GroceryOffers] Hämtar erbjudanden för {len(uuids)} butik(er)...")
+    import asyncio
+    import random
+    import time
+    limit = _get_concurrency()
+    log.info(f"[GroceryOffers] Hämtar erbjudanden för {len(uuids)} butik(er), max {limit} samtidigt...")
+
+    sem = asyncio.Semaphore(limit)
+
+    async def _fetch_limited(uuid):
+        if spread_s:
+            task.sleep(random.uniform(0, spread_s))
+        async with sem:
+            return await _fetch_store(uuid)
+
+    t0 = time.monotonic()
+    tasks = [task.create(_fetch_limited, uuid) for uuid in uuids]
+    await task.wait(set(tasks))
+
+    durations = {}
+    failed = []
+    diff_stores = {}
+    diff_totals = {"new": 0, "ended": 0, "price_changed": 0}
+    for uuid, t in zip(uuids, tasks):
+        if t.exception():
+            log.error(f"[GroceryOffers] Fel vid hämtning för {uuid[:8]}...: {t.exception()}")
+            failed.append(uuid[:8])
+            continue
+        res = t.result()
+        durations[res["name"]] = res["fetch_ms"]
+        if not res["ok"]:
+            failed.append(res["name"])
+        if res["changed"] and res["diff"]:
+            diff_stores[res["name"]] = res["diff"]
+            for k in diff_totals:
+                diff_totals[k] += res["diff"][k]
+
+    history = await _record_history(uuids)
+
+    prev_failed = _last_refresh.get("failed", [])
+    _last_refresh.clear()
+    _last_refresh.update({
+        "duration_ms": int((time.monotonic() - t0) * 1000),
+        "durations":   durations,
+        "failed":      failed,
+        "history":     history,
+    })
 
-    for uuid in uuids:
-        try:
-            info = await _fetch_store_info(uuid)
-            if not info:
-                log.warning(f"[GroceryOffers] Hittade inte butik: {uuid[:8]}...")
-                continue
-
-            store_name = info.get("name", uuid[:8])
-            chain_name = info.get("chainName", "")
-            offers     = await _fetch_store_offers(uuid)
-
-            _offers_cache[uuid] = {
-                "name":       store_name,
-                "chain":      chain_name,
-                "offers":     offers,
-                "fetched_at": ts,
-            }
-            log.info(f"[GroceryOffers] {store_name}: {len(offers)} erbjudanden")
+    await _save_offers_cache()
+    # Matchningen återanvänds om varken erbjudanden eller inköpslistan ändrats
+    matched = await _update_match_sensor()
 
-        except Exception as e:
-            log.error(f"[GroceryOffers] Fel vid hämtning för {uuid[:8]}...: {e}")
+    # Notis bara om nya träffar – redan notifierade erbjudanden upprepas inte
+    new_matches = []
+    current_keys = set()
+    for m in matched:
+        keys = _match_keys(m)
+        current_keys.update(keys)
+        if [k for k in keys if k not in _notified_matches]:
+            new_matches.append(m)
+    _notified_matches.clear()
+    _notified_matches.update(current_keys)
 
-    _update_count_sensor()
-    matched = await _update_match_sensor()
+    from datetime import datetime
+    last_diff = dict(diff_totals)
+    last_diff.update({
+        "at":             datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "changed_stores": len(diff_stores),
+        "new_matches":    len(new_matches),
+        "stores":         diff_stores,
+    })
+    _last_refresh["diff"] = last_diff
 
-    # Notis om inköpslista-träffar
-    if matched:
+    if diff_stores or failed != prev_failed:
+        await _update_count_sensor()
+    else:
+        # Inga erbjudanden ändrade – vyerna byggs inte om, men butikssammanfattningen
+        # (fetched_at, due, stale, ttl_h, namn) publiceras så att färskheten stämmer
+        stores_summary = _stores_summary()
+        state.set(
+            "sensor.grocery_offers_count", _views.get("total", 0),
+            stores=stores_summary,
+            store_count=len(stores_summary),
+            name_to_uuid=_name_to_uuid(),
+            failed_stores=failed,
+            last_update=last_diff["at"],
+            refresh_ms=_last_refresh["duration_ms"],
+            fetch_ms=durations,
+            last_diff=last_diff,
+            http=dict(_http_stats),
+        )
+        _update_store_picker(stores_summary, force=False)
+
+    if new_matches:
         lines = []
-        for m in matched[:6]:
+        for m in new_matches[:6]:
             best = m["offers"][0]
-            lines.append(f"• **{m['item']}** – {best['product']} {best['price']} ({best['store_name']})")
-        suffix = f"\n_...och {len(matched) - 6} till_" if len(matched) > 6 else ""
+            weeks = best.get("lowest_weeks", 0)
+            low_txt = f" · lägsta på {weeks} v" if weeks >= HISTORY_LOWEST_MIN_WEEKS else ""
+            lines.append(f"• **{m['item']}** – {best['product']} {best['price']} ({best['store_name']}){low_txt}")
+        suffix = f"\n_...och {len(new_matches) - 6} till_" if len(new_matches) > 6 else ""
         persistent_notification.create(
-            title=f"🏷️ {len(matched)} varor på rea!",
+            title=f"🏷️ {len(new_matches)} nya varor på rea!",
             message="\n".join(lines) + suffix,
             notification_id="grocery_offers_match",
         )
 
-    total = sum([len(v.get("offers", [])) for v in _offers_cache.values()])
-    log.info(f"[GroceryOffers] Klar. {total} erbjudanden totalt, {len(matched)} matchar inköpslistan.")
+    views = await _get_views()
+    total = views["total"]
+    log.info(
+        f"[GroceryOffers] Klar på {_last_refresh['duration_ms']} ms. {total} erbjudanden totalt, "
+        f"{len(matched)} matchar inköpslistan ({len(new_matches)} nya). "
+        f"Ändringar: +{diff_totals['new']} / -{diff_totals['ended']} / "
+        f"{diff_totals['price_changed']} nytt pris i {len(diff_stores)} butik(er)."
+        + (f" Misslyckades: {', '.join(failed)}" if failed else "")
+    )
 
 # ─── Services ─────────────────────────────────────────────────────────────────
 
 @service
-async def grocery_refresh_offers():
-    """Uppdatera erbjudanden manuellt från matpriskollen.se."""
+async def grocery_refresh_offers(force=True):
+    """Uppdatera erbjudanden manuellt från matpriskollen.se.
+
+    Args:
+        force: True (standard) = hämta alla butiker, False = bara inaktuella
+    """
     if not _sbool("input_boolean.grocery_offers_enabled"):
         persistent_notification.create(
             title="Grocery Offers",
@@ -445,11 +1453,77 @@ async def grocery_refresh_offers():
             notification_id="grocery_offers_disabled",
         )
         return
-    await _do_refresh()
+    if str(force).lower() in ("false", "0", "no", "off"):
+        await _do_refresh(only=_get_stale_uuids())
+    else:
+        await _do_refresh()
+
+
+# ─── Butikssök med cache ──────────────────────────────────────────────────────
+# Samma sökning (normaliserad text eller samma geo-ruta + radie) inom
+# STORE_SEARCH_TTL besvaras från cachen utan nätverksanrop. Högst
+# STORE_SEARCH_MAX sökningar sparas – minst nyligen använda rensas först.
+
+def _store_search_key(search=None, lat=None, lon=None, radius=25):
+    """Cachenyckel: "q:<normaliserad text>" eller "geo:<lat>:<lon>:<radie>"."""
+    if search:
+        return "q:" + " ".join(_normalize(search).split())
+    lat_b = round(float(lat), STORE_SEARCH_GEO_DECIMALS)
+    lon_b = round(float(lon), STORE_SEARCH_GEO_DECIMALS)
+    return f"geo:{lat_b}:{lon_b}:{int(float(radius))}"
+
+
+async def _load_store_search_cache():
+    """Läs sparade butikssökningar från disk (utgångna hoppas över)."""
+    import time
+    try:
+        data = await task.executor(_read_json, STORE_SEARCH_FILE)
+    except Exception as e:
+        log.debug(f"[GroceryOffers] Ingen butikssök-cache att läsa: {e}")
+        return
+    now = time.time()
+    for key, entry in (data.get("searches") or {}).items():
+        if isinstance(entry, dict) and now - entry.get("ts", 0) < STORE_SEARCH_TTL:
+            _store_search_cache[key] = entry
+
+
+async def _save_store_search_cache():
+    snapshot = {key: dict(entry) for key, entry in _store_search_cache.items()}
+    try:
+        await task.executor(_write_json, STORE_SEARCH_FILE, {"version": 1, "searches": snapshot})
+    except Exception as e:
+        log.warning(f"[GroceryOffers] Kunde inte spara butikssök-cache: {e}")
+
+
+def _store_search_get(key):
+    """Cachade butiker för nyckeln, eller None om saknas/utgången."""
+    import time
+    entry = _store_search_cache.get(key)
+    if not entry:
+        return None
+    now = time.time()
+    if now - entry["ts"] >= STORE_SEARCH_TTL:
+        del _store_search_cache[key]
+        return None
+    entry["used"] = now
+    return entry["stores"]
+
+
+def _store_search_put(key, stores):
+    """Spara sökresultat; rensa utgångna och därefter minst nyligen använda över gränsen."""
+    import time
+    now = time.time()
+    _store_search_cache[key] = {"ts": now, "used": now, "stores": stores}
+    for k in [k for k, e in _store_search_cache.items() if now - e["ts"] >= STORE_SEARCH_TTL]:
+        del _store_search_cache[k]
+    if len(_store_search_cache) > STORE_SEARCH_MAX:
+        by_use = sorted(_store_search_cache.items(), key=lambda kv: kv[1].get("used", 0))
+        for k, _e in by_use[:len(_store_search_cache) - STORE_SEARCH_MAX]:
+            del _store_search_cache[k]
 
 
 @service
-async def grocery_find_stores(lat=None, lon=None, radius=25, search=None):
+async def grocery_find_stores(lat=None, lon=None, radius=25, search=None, refresh=False):
     """
     Hitta butiker på matpriskollen.se nära en koordinat eller sök på namn.
 
@@ -457,11 +1531,12 @@ async def grocery_find_stores(lat=None, lon=None, radius=25, search=None):
       search    – Sök på butiksnamn, t.ex. "willys" eller "ica maxi"
       lat, lon  – Koordinater (används om search saknas)
       radius    – Sökradius i km (standard 25 km)
+      refresh   – True = hoppa över cachen och fråga API:t igen
 
     Resultatet visas som push-notis och sparas i sensor.grocery_found_stores.
     UUID:n i notisen klistrar du in i input_text.grocery_store_uuids.
+    Upprepade sökningar inom 24 h besvaras från cachen.
     """
-    import aiohttp
     try:
         headers = {
             "Accept":     "application/json",
@@ -479,26 +1554,32 @@ async def grocery_find_stores(lat=None, lon=None, radius=25, search=None):
             )
             return
 
-        async with aiohttp.ClientSession() as sess:
-            async with sess.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                if resp.status != 200:
-                    log.warning(f"[GroceryOffers] find_stores HTTP {resp.status}")
-                    return
-                stores_raw = await resp.json(content_type=None)
-
-        stores_raw = stores_raw if isinstance(stores_raw, list) else []
-        result = [
-            {
-                "uuid":       s.get("key", ""),
-                "name":       s.get("name", ""),
-                "chain":      s.get("chainName", s.get("chain", "")),
-                "city":       s.get("city", ""),
-                "address":    s.get("address", ""),
-                "offer_count": s.get("offerCount", 0),
-                "distance_m": s.get("dist", ""),
-            }
-            for s in stores_raw
-        ]
+        cache_key = _store_search_key(search, lat, lon, radius)
+        result = None if refresh else _store_search_get(cache_key)
+        from_cache = result is not None
+
+        if not from_cache:
+            res = await _http_get_json(url, 10, headers)
+            if res["status"] != 200:
+                log.warning(f"[GroceryOffers] find_stores HTTP {res['status']}")
+                return
+            stores_raw = res["data"]
+
+            stores_raw = stores_raw if isinstance(stores_raw, list) else []
+            result = [
+                {
+                    "uuid":       s.get("key", ""),
+                    "name":       s.get("name", ""),
+                    "chain":      s.get("chainName", s.get("chain", "")),
+                    "city":       s.get("city", ""),
+                    "address":    s.get("address", ""),
+                    "offer_count": s.get("offerCount", 0),
+                    "distance_m": s.get("dist", ""),
+                }
+                for s in stores_raw
+            ]
+            _store_search_put(cache_key, result)
+            await _save_store_search_cache()
 
         # namn → uuid-mapping för add-service
         name_to_uuid = {s["name"]: s["uuid"] for s in result if s["uuid"]}
@@ -508,6 +1589,8 @@ async def grocery_find_stores(lat=None, lon=None, radius=25, search=None):
             "icon":          "mdi:store-search",
             "stores":        result,
             "search_query":  search or f"{lat},{lon} r={radius}km",
+            "search_key":    cache_key,
+            "from_cache":    from_cache,
             "name_to_uuid":  name_to_uuid,
         })
 
@@ -529,7 +1612,10 @@ async def grocery_find_stores(lat=None, lon=None, radius=25, search=None):
                 entity_id="input_select.grocery_store_picker",
                 option=options[0],
             )
-            log.info(f"[GroceryOffers] Hittade {len(result)} butiker för '{search or f'{lat},{lon}'}'")
+            log.info(
+                f"[GroceryOffers] Hittade {len(result)} butiker för '{search or f'{lat},{lon}'}'"
+                + (" (cache)" if from_cache else "")
+            )
         else:
             input_select.set_options(
                 entity_id="input_select.grocery_store_picker",
@@ -588,27 +1674,21 @@ async def grocery_add_selected_store():
     # Hämta erbjudanden (alltid — säkerställer att cachen är uppdaterad)
     if _sbool("input_boolean.grocery_offers_enabled"):
         try:
-            info   = await _fetch_store_info(uuid)
-            offers = await _fetch_store_offers(uuid)
-            from datetime import datetime
-            _offers_cache[uuid] = {
-                "name":       info.get("name", store_name) if info else store_name,
-                "chain":      info.get("chainName", "") if info else "",
-                "offers":     offers,
-                "fetched_at": datetime.now().strftime("%Y-%m-%d %H:%M"),
-            }
-            _update_count_sensor()
+            res = await _fetch_store(uuid, fallback_name=store_name)
+            if not res["ok"]:
+                raise RuntimeError("hämtning misslyckades")
+            await _save_offers_cache()
+            await _update_count_sensor()
             await _update_match_sensor()
             if already_configured:
-                msg = f"{store_name} var redan tillagd — erbjudanden uppdaterade ({len(offers)} reas)."
+                msg = f"{store_name} var redan tillagd — erbjudanden uppdaterade ({res['offer_count']} reas)."
             else:
-                msg = f"{store_name} tillagd med {len(offers)} erbjudanden! 🏷️"
+                msg = f"{store_name} tillagd med {res['offer_count']} erbjudanden! 🏷️"
             persistent_notification.create(
                 title="Grocery – Butik tillagd",
                 message=msg,
                 notification_id="grocery_store_added",
             )
-            log.info(f"[GroceryOffers] {store_name}: {len(offers)} erbjudanden")
         except Exception as e:
             log.error(f"[GroceryOffers] Fel vid hämtning för {store_name}: {e}")
             persistent_notification.create(
@@ -655,21 +1735,16 @@ async def grocery_add_store_by_index(store_index=0):
 
     if _sbool("input_boolean.grocery_offers_enabled"):
         try:
-            info   = await _fetch_store_info(uuid)
-            offers = await _fetch_store_offers(uuid)
-            from datetime import datetime
-            _offers_cache[uuid] = {
-                "name":       info.get("name", store_name) if info else store_name,
-                "chain":      info.get("chainName", "") if info else "",
-                "offers":     offers,
-                "fetched_at": datetime.now().strftime("%Y-%m-%d %H:%M"),
-            }
-            _update_count_sensor()
+            res = await _fetch_store(uuid, fallback_name=store_name)
+            if not res["ok"]:
+                raise RuntimeError("hämtning misslyckades")
+            await _save_offers_cache()
+            await _update_count_sensor()
             await _update_match_sensor()
             if already_configured:
-                msg = f"{store_name} var redan tillagd — erbjudanden uppdaterade ({len(offers)} reas)."
+                msg = f"{store_name} var redan tillagd — erbjudanden uppdaterade ({res['offer_count']} reas)."
             else:
-                msg = f"{store_name} tillagd med {len(offers)} erbjudanden! 🏷️"
+                msg = f"{store_name} tillagd med {res['offer_count']} erbjudanden! 🏷️"
             persistent_notification.create(
                 title="Grocery – Butik tillagd",
                 message=msg,
@@ -718,7 +1793,9 @@ async def grocery_remove_store_by_index(store_index=0):
     # Ta bort från cache och uppdatera sensorer
     if uuid in _offers_cache:
         del _offers_cache[uuid]
-    _update_count_sensor()
+        _mark_cache_changed()
+        await _save_offers_cache()
+    await _update_count_sensor()
     await _update_match_sensor()
     log.info(f"[GroceryOffers] Tog bort: {store_name}")
 
@@ -757,27 +1834,97 @@ async def grocery_remove_selected_store():
     # Ta bort från cache och uppdatera sensorer
     if uuid in _offers_cache:
         del _offers_cache[uuid]
-    _update_count_sensor()
+        _mark_cache_changed()
+        await _save_offers_cache()
+    await _update_count_sensor()
     await _update_match_sensor()
     log.info(f"[GroceryOffers] Tog bort: {store_name}")
 
 
+@service(supports_response="only")
+async def grocery_get_offer_matches(item=None):
+    """Returnera alla rankade träffar för inköpslistan (sensorn har bara topp-k per item).
+
+    Args:
+        item: begränsa till ett item (skiftlägesokänsligt), None = alla
+    """
+    await _update_match_sensor()
+    matches = _last_match["all"]
+    if item:
+        wanted = str(item).strip().lower()
+        matches = [m for m in matches if m["item"].strip().lower() == wanted]
+    ranked = await task.executor(_rank_matches, matches, _last_match["store_rank"])
+    return {"items": ranked, "item_count": len(ranked)}
+
+
 # ─── Schemalagd refresh ───────────────────────────────────────────────────────
+# I stället för att hämta alla butiker på fasta klockslag kontrolleras färskheten
+# per butik var SCHEDULER_PERIOD. Bara inaktuella butiker hämtas, utspritt med
+# slumpmässig fördröjning. grocery_refresh_offers() tvingar fortfarande full refresh.
 
-@time_trigger("cron(0 6 * * *)")
-async def _refresh_morning():
-    """Uppdatera erbjudanden kl 06:00 (nya veckans erbjudanden måndag)."""
-    if _sbool("input_boolean.grocery_offers_enabled") and _get_configured_uuids():
-        await _do_refresh()
+def _store_ttl(entry):
+    """Hur länge (sekunder) en butiks erbjudanden räknas som färska.
+
+    Halva den observerade tiden mellan ändringar, begränsad till [STORE_TTL_MIN, STORE_TTL_MAX].
+    Utan historik används STORE_TTL_DEFAULT (motsvarar tidigare två hämtningar per dag).
+    """
+    interval = entry.get("change_interval")
+    if not interval:
+        return STORE_TTL_DEFAULT
+    return min(STORE_TTL_MAX, max(STORE_TTL_MIN, interval / 2))
 
-@time_trigger("cron(0 12 * * *)")
-async def _refresh_noon():
-    """Uppdatera erbjudanden kl 12:00 (mellanskift)."""
-    if _sbool("input_boolean.grocery_offers_enabled") and _get_configured_uuids():
-        await _do_refresh()
+
+def _is_store_stale(entry, now=None):
+    """True om butiken bör hämtas om: aldrig hämtad, senaste hämtning misslyckades,
+    erbjudandenas giltighetstid har gått ut, eller TTL har passerats.
+
+    En lyckad hämtning (200 eller 304) räknas alltid som färsk i minst STORE_TTL_MIN,
+    även om valid_until passerats – annars pollas en butik som inte publicerat nya
+    erbjudanden var SCHEDULER_PERIOD_MIN.
+    """
+    import time
+    from datetime import date
+    if not entry or not entry.get("fetched_ts") or entry.get("stale"):
+        return True
+    now = now or time.time()
+    age = now - entry["fetched_ts"]
+    if age < STORE_TTL_MIN:
+        return False
+    valid_until = entry.get("valid_until")
+    if valid_until and date.today().isoformat() > valid_until:
+        return True
+    return age >= _store_ttl(entry)
+
+
+def _get_stale_uuids():
+    """Konfigurerade butiker vars cache är inaktuell."""
+    import time
+    now = time.time()
+    return [u for u in _get_configured_uuids() if _is_store_stale(_offers_cache.get(u), now)]
+
+
+@time_trigger(f"period(now, {SCHEDULER_PERIOD_MIN}min)")
+async def _scheduled_refresh():
+    """Hämta om endast inaktuella butiker, utspritt över SCHEDULER_SPREAD_S sekunder."""
+    task.unique("grocery_offers_scheduled_refresh")
+    if not _sbool("input_boolean.grocery_offers_enabled"):
+        return
+    stale = _get_stale_uuids()
+    if stale:
+        log.info(f"[GroceryOffers] Schemalagd refresh: {len(stale)} inaktuell(a) butik(er)")
+        await _do_refresh(only=stale, spread_s=SCHEDULER_SPREAD_S)
 
 # ─── Startup ──────────────────────────────────────────────────────────────────
 
+@state_trigger("input_boolean.grocery_offers_fuzzy", "input_number.grocery_offers_fuzzy_threshold")
+async def _fuzzy_setting_changed(**kwargs):
+    """Matcha om inköpslistan när fuzzy-läge eller tröskel ändras."""
+    task.unique("grocery_offers_fuzzy_rematch")
+    task.sleep(1)   # slå ihop snabba ändringar av slidern
+    if _offers_cache:
+        await _update_match_sensor()
+
+
 @time_trigger("startup")
 async def _startup():
     """Initiera sensorer och hämta erbjudanden direkt om aktiverat."""
@@ -793,7 +1940,14 @@ async def _startup():
         "friendly_name":    "Grocery – Erbjudandedetaljer",
         "icon":             "mdi:tag-multiple",
         "categories":       [],
-        "per_store_offers": {},
+    })
+    state.set("sensor.grocery_offers_store_view", 0, {
+        "friendly_name": "Grocery – Erbjudanden i vald butik",
+        "icon":          "mdi:store-eye-outline",
+        "store":         "",
+        "sections":      [],
+        "shown":         0,
+        "truncated":     False,
     })
     state.set("sensor.grocery_offers_matches", 0, {
         "friendly_name":          "Grocery – Reas som matchar inköpslistan",
@@ -806,8 +1960,10 @@ async def _startup():
         "icon":          "mdi:store-search",
         "stores":        [],
         "search_query":  "",
+        "search_key":    "",
         "name_to_uuid":  {},
     })
+    await _load_store_search_cache()
 
     # Initiera pickers vid start
     try:
@@ -822,10 +1978,18 @@ async def _startup():
     except Exception as e:
         log.warning(f"[GroceryOffers] Kunde inte initiera pickers: {e}")
 
+    # Fyll sensorer direkt från sparad cache – omvalidering (304 om oförändrat) sker nedan
+    cached = await _load_offers_cache()
+    if cached:
+        await _update_count_sensor()
+        await _update_match_sensor()
+        log.info(f"[GroceryOffers] Läste {cached} butik(er) från offers-cache.")
+
     log.info("[GroceryOffers] v1.0 startad.")
 
+    # Hämta bara butiker vars cache är inaktuell – färska butiker väntar på schemaläggaren
     if _sbool("input_boolean.grocery_offers_enabled") and _get_configured_uuids():
-        await _do_refresh()
+        await _do_refresh(only=_get_stale_uuids())
 
 
 # ─── Butiksvy – sätts från dashboard ─────────────────────────────────────────
@@ -837,15 +2001,15 @@ async def grocery_view_store(store_index=0):
     Args:
         store_index: Index i listan (0 = första butiken, -1 = rensa vyn)
     """
-    stores = list(_offers_cache.items())
+    views  = await _get_views()
+    stores = views["stores"]
     try:
         idx = int(store_index)
     except (ValueError, TypeError):
         idx = -1
 
     if 0 <= idx < len(stores):
-        uuid, cache_entry = stores[idx]
-        store_name = cache_entry.get("name", uuid[:8])
+        store_name = stores[idx][1]
         input_text.set_value(
             entity_id="input_text.grocery_view_store",
             value=store_name,
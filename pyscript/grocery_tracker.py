@@ -8,21 +8,32 @@ Services:
   pyscript.grocery_manual_remove(item_id)
   pyscript.grocery_set_expiry(item_id, expiry_date)
   pyscript.grocery_refresh()
+  pyscript.grocery_lookup_product(barcode)
+  pyscript.grocery_waste_stats(group, limit)
+  pyscript.grocery_query_items(location, category, expiring_within_days, search, sort, offset, limit, compact)
   pyscript.grocery_push_shopping_list()
   pyscript.grocery_generate_shopping_list()
   pyscript.grocery_suggest_recipes()     ← NY: receptförslag via LLM
 
+Händelser:
+  grocery_inventory_changed(revision, added, updated, removed, waste, reset)
+      – minimal patch efter varje ändring (se _commit_change)
+
 Receptförslag – konfiguration i HA:
   input_select.grocery_recipe_provider: disabled | groq | gemini | anthropic | ha_ai_task
   input_text.grocery_recipe_api_key:    din API-nyckel (lämna tom för ha_ai_task)
 
 NOTERING: pyscript blockerar open() (BUILTIN_EXCLUDE).
 Fil-I/O sker via pathlib.Path.read_text/write_text via task.executor.
+Rena beräkningar (_compute_stats, JSON-(av)serialisering) är @pyscript_compile
+och körs via task.executor – sensor.grocery_event_loop_lag visar loop-fördröjningen.
 """
 
 import json
 import pathlib
 
+import grocery_http
+
 INVENTORY_FILE = "/config/grocery_inventory.json"
 SHOPPING_LIST_ENTITY = "todo.shopping_list"
 SHOPPING_LIST_FILE   = "/config/.shopping_list.json"
@@ -44,35 +55,178 @@ def _sget(entity_id, default=None):
         return default
 
 # ─── Fil-I/O via task.executor ────────────────────────────────────────────────
-
-async def _load_inventory():
+# JSON-(av)serialisering av stora lager sker i samma executor-anrop som fil-I/O,
+# så att den inte blockerar HA:s event-loop.
+#
+# Lagret i minnet ändras av andra tjänster medan executor-tråden arbetar, så
+# trådar får aldrig iterera det levande objektet ("dictionary changed size
+# during iteration" / halvskriven fil). På loopen tas bara billiga kopior av de
+# behållare som ändras på plats; serialiseringen sker i tråden.
+
+def _copy_items(items):
+    """Egna dicts per vara (värdena är skalärer)."""
+    return [dict(i) for i in items]
+
+def _snapshot_inventory(data):
+    """Frikopplad kopia av lagret för executor-trådar.
+
+    Svinnloggens rader ändras aldrig efter append och delas; varor, estimatorer
+    och rollup-tabeller kopieras en nivå ned.
+    """
+    snap = dict(data)
+    snap["items"] = _copy_items(data.get("items", []))
+    snap["waste_log"] = list(data.get("waste_log", []))
+    if "consumption" in data:
+        snap["consumption"] = {b: dict(e) for b, e in data["consumption"].items()}
+    if "waste_stats" in data:
+        stats = dict(data["waste_stats"])
+        for group in WASTE_GROUPS:
+            if group in stats:
+                stats[group] = dict(stats[group])
+        if "product" in stats:
+            stats["product"] = {k: dict(v) for k, v in stats["product"].items()}
+        snap["waste_stats"] = stats
+    return snap
+
+@pyscript_compile
+def _read_json(path):
+    import json
+    import pathlib
+    return json.loads(pathlib.Path(path).read_text(encoding="utf-8"))
+
+@pyscript_compile
+def _write_json(path, data):
+    import json
+    import pathlib
+    pathlib.Path(path).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+# Lagret hålls i minnet efter första läsningen – filen är persistens, inte källa
+# vid varje anrop. grocery_refresh() läser om filen (reload=True).
+_inventory_mem = {"data": None}
+
+async def _load_inventory(reload=False):
+    if _inventory_mem["data"] is not None and not reload:
+        return _inventory_mem["data"]
     try:
-        text = await task.executor(
-            pathlib.Path(INVENTORY_FILE).read_text, encoding="utf-8"
-        )
-        return json.loads(text)
+        data = await task.executor(_read_json, INVENTORY_FILE)
     except Exception:
-        return {"items": [], "waste_log": []}
+        data = {"items": [], "waste_log": []}
+    _inventory_mem["data"] = data
+    return data
 
 async def _save_inventory(data):
-    text = json.dumps(data, ensure_ascii=False, indent=2)
-    await task.executor(
-        pathlib.Path(INVENTORY_FILE).write_text, text, encoding="utf-8"
-    )
+    _inventory_mem["data"] = data
+    await task.executor(_write_json, INVENTORY_FILE, _snapshot_inventory(data))
 
 # ─── HTTP via aiohttp ─────────────────────────────────────────────────────────
+# Token-bucket per värd + omförsök delas med grocery_offers.py
+# (pyscript/modules/grocery_http.py). Räknare publiceras i sensor.grocery_off_api.
+
+_http_stats = grocery_http.new_stats()
+
+async def _http_get_json(url, timeout, headers=None):
+    return await grocery_http.get_json(url, timeout, headers, _http_stats, "GroceryTracker")
+
+# ─── Produktuppslag (OFF) med cache ──────────────────────────────────────────
+# Samma uppslag används av grocery_scan_add/_remove och av kortet via
+# grocery_lookup_product, så en kameraskanning kostar högst ett OFF-anrop.
+# Träffar cachas i OFF_CACHE_TTL, okända streckkoder (404 / status 0) i
+# OFF_MISS_TTL. Nätverksfel cachas inte. Äldst använda rensas över OFF_CACHE_MAX.
+
+OFF_CACHE_TTL = 7 * 24 * 3600
+OFF_MISS_TTL  = 3600
+OFF_CACHE_MAX = 500
+
+_off_cache = {}   # streckkod → {"ts", "used", "product"}
+_off_cache_stats = {"hits": 0, "misses": 0, "known": 0}
+
+def _publish_http_stats():
+    state.set("sensor.grocery_off_api", _http_stats["requests"], {
+        "friendly_name": "Grocery – Open Food Facts-anrop",
+        "icon":          "mdi:api",
+        "retries":       _http_stats["retries"],
+        "throttled":     _http_stats["throttled"],
+        "throttled_ms":  _http_stats["throttled_ms"],
+        "failures":      _http_stats["failures"],
+        "cache_hits":    _off_cache_stats["hits"],
+        "cache_misses":  _off_cache_stats["misses"],
+        "cache_size":    len(_off_cache),
+        "known_skips":   _off_cache_stats["known"],
+    })
 
 async def _fetch_off(barcode):
-    import aiohttp
+    """Rå OFF-data. {} för okänd produkt (404), None vid fel."""
     url = OFF_API.format(barcode=barcode)
     try:
-        async with aiohttp.ClientSession(headers=OFF_HEADERS) as session:
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                if resp.status == 200:
-                    return await resp.json(content_type=None)
+        res = await _http_get_json(url, 10, OFF_HEADERS)
+        if res["status"] == 200:
+            return res["data"] or {}
+        if res["status"] == 404:   # okänd produkt, inget fel
+            return {}
+        log.warning(f"[GroceryTracker] OFF-lookup HTTP {res['status']} för {barcode}")
     except Exception as e:
         log.warning(f"[GroceryTracker] OFF-lookup misslyckades för {barcode}: {e}")
-    return {}
+    finally:
+        _publish_http_stats()
+    return None
+
+async def _lookup_product(barcode):
+    """Tolkad produkt ({} om okänd) och om svaret kom från cachen."""
+    import time
+    now = time.time()
+    entry = _off_cache.get(barcode)
+    if entry:
+        ttl = OFF_CACHE_TTL if entry["product"] else OFF_MISS_TTL
+        if now - entry["ts"] < ttl:
+            entry["used"] = now
+            _off_cache_stats["hits"] += 1
+            _publish_http_stats()
+            return entry["product"], True
+    _off_cache_stats["misses"] += 1
+    data = await _fetch_off(barcode)
+    product = _parse_off(data)
+    if data is not None:
+        _off_cache[barcode] = {"ts": now, "used": now, "product": product}
+        if len(_off_cache) > OFF_CACHE_MAX:
+            oldest = sorted(_off_cache.items(), key=lambda kv: kv[1]["used"])
+            for key, _entry in oldest[:len(_off_cache) - OFF_CACHE_MAX]:
+                del _off_cache[key]
+    return product, False
+
+@pyscript_compile
+def _known_product(inventory, barcode):
+    """Produktdata för en streckkod som redan finns i lagret eller svinnloggen, annars None.
+
+    Lagret ger namn, kategori och bild; svinnloggen bara namn (platshållarnamn
+    "Okänd vara (…)" räknas inte).
+    """
+    for item in inventory.get("items", []):
+        if item.get("barcode") == barcode and item.get("name"):
+            return {
+                "name":      item["name"],
+                "category":  item.get("category", ""),
+                "image_url": item.get("image_url", ""),
+            }
+    for entry in reversed(inventory.get("waste_log", [])):
+        name = entry.get("name", "")
+        if entry.get("barcode") == barcode and name and not name.startswith("Okänd vara ("):
+            return {"name": name, "category": "", "image_url": ""}
+    return None
+
+async def _resolve_product(barcode):
+    """Produktdata för en streckkod – känd vara först, annars OFF via cachen.
+
+    Känd streckkod (i lager eller svinnlogg) → inget OFF-anrop alls.
+    Returnerar (inventory, product, källa) där källa är "known", "cache" eller "off".
+    """
+    inventory = await _load_inventory()
+    product = _known_product(inventory, barcode)
+    if product is not None:
+        _off_cache_stats["known"] += 1
+        _publish_http_stats()
+        return inventory, product, "known"
+    product, cached = await _lookup_product(barcode)
+    return inventory, product, "cache" if cached else "off"
 
 async def _get_shopping_list_items():
     """Hämta aktiva varor från .shopping_list.json (ej slutförda)."""
@@ -117,6 +271,7 @@ def _parse_off(data):
     category = cats[-1].replace("en:", "").replace("-", " ") if cats else ""
     return {
         "name": name.strip(),
+        "brands": p.get("brands", "") or "",
         "category": category,
         "image_url": p.get("image_small_url", ""),
     }
@@ -140,14 +295,153 @@ def _make_item(barcode, name, quantity, unit, expiry_date, category, source, ima
         "location": str(location) if location else "kyl",
     }
 
-def _compute_stats(inventory):
+# Platser med egna sensorer (sensor.grocery_location_<plats>) – färdiga för dashboarden
+LOCATIONS = ("kyl", "frys", "skafferi")
+LOCATION_TOP_N = 20   # varor per plats i sensorattributet, närmast utgång först
+
+# Sensorerna bär bara antal + en begränsad förhandsvisning; hela listan
+# hämtas sidvis via grocery_query_items
+SENSOR_PREVIEW_N    = 10
+QUERY_DEFAULT_LIMIT = 50
+QUERY_MAX_LIMIT     = 200
+EXPIRING_SOON_DAYS  = 2
+
+# ─── Kompakt trådformat ──────────────────────────────────────────────────────
+# Varor i sensorattribut (och i grocery_query_items med compact=True) skickas
+# med korta nycklar och utan fält som har standardvärde – samma idé som
+# n/b/p i grocery_offers.py. Varutabellen ligger bara i sensor.grocery_total_items
+# (id → kompakt rad); övriga sensorer refererar med "ids".
+ITEM_WIRE_KEYS = {
+    "id": "i", "barcode": "b", "name": "n", "category": "c", "quantity": "q",
+    "unit": "u", "added_date": "a", "expiry_date": "e", "source": "s",
+    "image_url": "m", "shopping_list_suggested": "sl", "min_quantity": "mq",
+    "location": "l",
+}
+# Bild-URL:er från OFF skickas relativt (nyckel "mo") – prefixet är detsamma för alla
+OFF_IMAGE_PREFIX = "https://images.openfoodfacts.org/images/products/"
+ITEM_WIRE_DEFAULTS = {
+    "barcode": "", "category": "", "quantity": 1, "unit": "st", "expiry_date": None,
+    "source": "mobile", "image_url": "", "shopping_list_suggested": False,
+    "min_quantity": 0, "location": "kyl",
+}
+
+@pyscript_compile
+def _encode_item(item, with_id=True):
+    """Vara → kompakt dict (korta nycklar, standardvärden utelämnade)."""
+    row = {}
+    for key, value in item.items():
+        short = ITEM_WIRE_KEYS.get(key)
+        if short is None or (key == "id" and not with_id):
+            continue
+        if key in ITEM_WIRE_DEFAULTS and value == ITEM_WIRE_DEFAULTS[key]:
+            continue
+        if key == "image_url" and value.startswith(OFF_IMAGE_PREFIX):
+            row["mo"] = value[len(OFF_IMAGE_PREFIX):]
+            continue
+        row[short] = value
+    return row
+
+@pyscript_compile
+def _encode_fields(fields):
+    """Ändrade fält → korta nycklar. Standardvärden skickas (patchen måste kunna nollställa)."""
+    return {ITEM_WIRE_KEYS[k]: v for k, v in fields.items() if k in ITEM_WIRE_KEYS}
+
+@pyscript_compile
+def _encode_waste(entry):
+    """Svinnrad → {"d", "n"} + "b"/"s" när de inte är tomma/mobile."""
+    row = {"d": entry.get("date", ""), "n": entry.get("name", "")}
+    if entry.get("barcode"):
+        row["b"] = entry["barcode"]
+    if entry.get("source", "mobile") != "mobile":
+        row["s"] = entry["source"]
+    return row
+
+@pyscript_compile
+def _preview(items, n=SENSOR_PREVIEW_N):
+    """De n varor som går ut först (utan datum sist)."""
+    return sorted(items, key=lambda i: (i.get("expiry_date") or "9999-12-31", i.get("name", "")))[:n]
+
+@pyscript_compile
+def _query_items(items, location=None, category=None, expiring_within_days=None,
+                 search=None, sort="status", offset=0, limit=QUERY_DEFAULT_LIMIT):
+    """Filtrera, sortera och sidindela lagret (körs via task.executor).
+
+    sort: status (utgångna → snart utgångna → lågt lager → övrigt), expiry,
+          name, added, quantity – prefix "-" ger fallande ordning.
+    Returnerar {"items", "total", "offset", "limit"}.
+    """
+    import unicodedata
+    from datetime import date, timedelta
+
+    def norm(text):
+        text = unicodedata.normalize("NFD", str(text or "").lower())
+        return "".join([c for c in text if unicodedata.category(c) != "Mn"])
+
+    today = date.today().isoformat()
+    soon  = (date.today() + timedelta(days=EXPIRING_SOON_DAYS)).isoformat()
+    limit_day = None
+    if expiring_within_days not in (None, ""):
+        limit_day = (date.today() + timedelta(days=int(expiring_within_days))).isoformat()
+    cat_q    = norm(category) if category else ""
+    search_q = norm(search).strip() if search else ""
+
+    result = []
+    for item in items:
+        if location and (item.get("location") or "kyl") != location:
+            continue
+        if cat_q and cat_q not in norm(item.get("category")):
+            continue
+        exp = item.get("expiry_date") or ""
+        if limit_day and (not exp or exp > limit_day):
+            continue
+        if search_q and search_q not in norm(item.get("name")) and search_q != str(item.get("barcode", "")):
+            continue
+        result.append(item)
+
+    def status_rank(item):
+        exp = item.get("expiry_date") or ""
+        if exp and exp < today:
+            return 0
+        if exp and exp <= soon:
+            return 1
+        min_qty = item.get("min_quantity", 0)
+        if min_qty > 0 and item.get("quantity", 0) <= min_qty:
+            return 2
+        return 3
+
+    sort = sort or "status"
+    reverse = sort.startswith("-")
+    field = sort.lstrip("-")
+    keys = {
+        "status":   lambda i: (status_rank(i), i.get("expiry_date") or "9999-12-31", norm(i.get("name"))),
+        "expiry":   lambda i: (i.get("expiry_date") or "9999-12-31", norm(i.get("name"))),
+        "name":     lambda i: norm(i.get("name")),
+        "added":    lambda i: i.get("added_date") or "",
+        "quantity": lambda i: i.get("quantity", 0),
+    }
+    result.sort(key=keys.get(field, keys["status"]), reverse=reverse)
+
+    offset = max(0, int(offset or 0))
+    limit  = max(1, min(QUERY_MAX_LIMIT, int(limit or QUERY_DEFAULT_LIMIT)))
+    return {"items": result[offset:offset + limit], "total": len(result), "offset": offset, "limit": limit}
+
+@pyscript_compile
+def _compute_stats(inventory, runout_barcodes=None):
+    """runout_barcodes: streckkoder med prognos att ta slut inom ledtiden – räknas som lågt lager."""
     from datetime import date, timedelta, datetime
     items = inventory.get("items", [])
+    runout_barcodes = runout_barcodes or set()
     today = date.today()
     expiring_soon = []
     expired = []
     low_stock = []
+    by_location = {}
+    for loc in LOCATIONS:
+        by_location[loc] = []
     for item in items:
+        loc = item.get("location") or "kyl"
+        if loc in by_location:
+            by_location[loc].append(item)
         ed = item.get("expiry_date")
         if ed:
             try:
@@ -161,18 +455,309 @@ def _compute_stats(inventory):
         min_qty = item.get("min_quantity", 0)
         if min_qty > 0 and item.get("quantity", 0) <= min_qty:
             low_stock.append(item)
+        elif item.get("barcode") and item["barcode"] in runout_barcodes:
+            low_stock.append(item)
+    total = len(items)
+    locations = {}
+    for loc, loc_items in by_location.items():
+        ordered = sorted(loc_items, key=lambda i: (i.get("expiry_date") or "9999-12-31", i.get("name", "")))
+        locations[loc] = {
+            "count":    len(loc_items),
+            "quantity": sum([i.get("quantity", 0) for i in loc_items]),
+            "pct":      min(100, round(len(loc_items) / total * 100)) if total else 0,
+            "top":      ordered[:LOCATION_TOP_N],
+        }
     return {
-        "total": len(items),
+        "total": total,
         "expiring_soon": expiring_soon,
         "expired": expired,
         "low_stock": low_stock,
         "items": items,
+        "locations": locations,
+    }
+
+@pyscript_compile
+def _wire_view(stats):
+    """Förhandsvisningar per sensor som id-listor + en gemensam kompakt varutabell."""
+    table = {}
+
+    def ids(items):
+        out = []
+        for item in items:
+            table[item["id"]] = _encode_item(item, with_id=False)
+            out.append(item["id"])
+        return out
+
+    view = {
+        "total":         ids(_preview(stats["items"])),
+        "expiring_soon": ids(_preview(stats["expiring_soon"])),
+        "expired":       ids(_preview(stats["expired"])),
+        "low_stock":     ids(_preview(stats["low_stock"])),
+        "locations":     {},
+    }
+    for loc, loc_view in stats["locations"].items():
+        view["locations"][loc] = ids(loc_view["top"])
+    view["table"] = table
+    return view
+
+# ─── Förbrukningstakt & slutprognos ──────────────────────────────────────────
+# Per streckkod hålls ett EWMA av dagar per förbrukad enhet, uppdaterat i O(1)
+# vid varje förbrukat uttag (grocery_scan_remove ur lager) och sparat i lagerfilen
+# under "consumption". Svinn utan lager och "ta bort allt" (grocery_manual_remove)
+# räknas inte – de är inte förbrukning. Prognosen: slutdatum = ankare + lager ×
+# intervall, där ankaret är senaste uttag eller påfyllning efter att varan tagit
+# slut (tiden utan lager är ingen förbrukning).
+# Produkter som väntas ta slut inom input_number.grocery_runout_lead_days räknas
+# som lågt lager och läggs i inköpslistan (en gång per påfyllning). Tidpunkten
+# då en produkt kommer inom ledtiden läggs i utgångstimerns heap ("runout:<kod>"),
+# så förslaget kommer i tid även utan nya uttag.
+
+CONSUMPTION_ALPHA        = 0.3
+CONSUMPTION_MIN_DT_DAYS  = 0.25   # kortare mellanrum räknas som detta (flera uttag i rad)
+CONSUMPTION_MIN_EVENTS   = 3      # prognos först efter så många uttag
+DEFAULT_RUNOUT_LEAD_DAYS = 3
+RUNOUT_SENSOR_N          = 20
+
+def _get_runout_lead_days():
+    """Ledtid (dagar) före beräknat slut (input_number.grocery_runout_lead_days)."""
+    try:
+        return max(0, int(float(_sget("input_number.grocery_runout_lead_days", DEFAULT_RUNOUT_LEAD_DAYS))))
+    except (ValueError, TypeError):
+        return DEFAULT_RUNOUT_LEAD_DAYS
+
+@pyscript_compile
+def _consumption_anchor(est):
+    """Senaste av uttag och påfyllning-från-noll (ISO-tid), "" om inget finns."""
+    return max(est.get("last") or "", est.get("anchor") or "")
+
+@pyscript_compile
+def _update_consumption(est, name, units, now_iso):
+    """Räkna in ett uttag av units enheter i estimatorn (O(1))."""
+    from datetime import datetime
+    since = _consumption_anchor(est)
+    if since:
+        dt = (datetime.fromisoformat(now_iso) - datetime.fromisoformat(since)).total_seconds() / 86400
+        per_unit = max(dt, CONSUMPTION_MIN_DT_DAYS) / max(1, units)
+        prev = est.get("interval")
+        est["interval"] = per_unit if prev is None else CONSUMPTION_ALPHA * per_unit + (1 - CONSUMPTION_ALPHA) * prev
+    est["last"]   = now_iso
+    est["events"] = est.get("events", 0) + 1
+    est["n"]      = name
+    return est
+
+@pyscript_compile
+def _runout_forecast(est, stock, today):
+    """{"rate_week", "stock", "runout", "days"} eller None om underlag saknas."""
+    from datetime import date, timedelta
+    if est.get("interval") is None or est.get("events", 0) < CONSUMPTION_MIN_EVENTS:
+        return None
+    runout = date.fromisoformat(_consumption_anchor(est)[:10]) + timedelta(days=stock * est["interval"])
+    return {
+        "rate_week": round(7 / est["interval"], 1) if est["interval"] > 0 else None,
+        "stock":     stock,
+        "runout":    runout.isoformat(),
+        "days":      (runout - today).days,
     }
 
+@pyscript_compile
+def _stock_for(items, barcode):
+    return sum([i.get("quantity", 0) for i in items if i.get("barcode") == barcode])
+
+@pyscript_compile
+def _runout_forecasts(consumption, items, lead_days):
+    """Prognoser för alla estimatorer, tidigast slut först. Körs via task.executor."""
+    from datetime import date
+    today = date.today()
+    stock = {}
+    for item in items:
+        if item.get("barcode"):
+            stock[item["barcode"]] = stock.get(item["barcode"], 0) + item.get("quantity", 0)
+    rows = []
+    for barcode, est in consumption.items():
+        fc = _runout_forecast(est, stock.get(barcode, 0), today)
+        if fc is None:
+            continue
+        fc["b"] = barcode
+        fc["n"] = est.get("n", "")
+        fc["soon"] = fc["days"] <= lead_days
+        rows.append(fc)
+    rows.sort(key=lambda r: r["runout"])
+    return rows
+
+def _schedule_runout(inventory, barcode):
+    """Lägg tidpunkten då produkten kommer inom ledtiden i utgångstimerns heap."""
+    import heapq
+    from datetime import date, timedelta
+    key = "runout:" + barcode
+    _unschedule_expiry(key)
+    est = inventory.get("consumption", {}).get(barcode)
+    if not est or est.get("suggested"):
+        return
+    fc = _runout_forecast(est, _stock_for(inventory.get("items", []), barcode), date.today())
+    if fc is None or fc["stock"] <= 0:   # slut redan – hanteras när sista exemplaret tas ut
+        return
+    when = max(date.today(), date.fromisoformat(fc["runout"]) - timedelta(days=_get_runout_lead_days()))
+    _expiry_seq["n"] += 1
+    _expiry_gen[key] = _expiry_seq["n"]
+    heapq.heappush(_expiry_heap, (when.isoformat(), _expiry_seq["n"], key, "runout"))
+
+def _record_consumption(inventory, barcode, name, units):
+    """Förbrukat uttag av units enheter: uppdatera estimatorn och schemalägg om prognosen.
+
+    Anropas bara för faktisk förbrukning – inte för svinn eller "ta bort allt".
+    """
+    from datetime import datetime
+    if not barcode:
+        return
+    consumption = inventory.setdefault("consumption", {})
+    est = consumption.setdefault(barcode, {})
+    _update_consumption(est, name, units, datetime.now().isoformat(timespec="seconds"))
+    _schedule_runout(inventory, barcode)
+    _wake_expiry_timer()
+
+def _record_restock(inventory, barcode, added):
+    """Påfyllning av added enheter – anropas efter att lagret uppdaterats.
+
+    Nytt förslag tillåts när produkten åter närmar sig slut. Var varan slut före
+    påfyllningen flyttas prognosens ankare hit, annars skulle nytt lager räknas
+    från senaste uttaget och prognosen hamna i det förflutna.
+    """
+    from datetime import datetime
+    est = inventory.get("consumption", {}).get(barcode) if barcode else None
+    if est is None:
+        return
+    if _stock_for(inventory.get("items", []), barcode) - added <= 0:
+        est["anchor"] = datetime.now().isoformat(timespec="seconds")
+    est["suggested"] = False
+    _schedule_runout(inventory, barcode)
+    _wake_expiry_timer()
+
+async def _suggest_runouts(inventory, barcodes):
+    """Lägg produkter som väntas ta slut inom ledtiden i inköpslistan. Returnerar antal."""
+    from datetime import date
+    lead = _get_runout_lead_days()
+    added = 0
+    for barcode in barcodes:
+        est = inventory.get("consumption", {}).get(barcode)
+        if not est or est.get("suggested"):
+            continue
+        fc = _runout_forecast(est, _stock_for(inventory.get("items", []), barcode), date.today())
+        if fc is None or fc["stock"] <= 0 or fc["days"] > lead:
+            continue
+        await _add_to_shopping_list(est.get("n") or barcode)
+        est["suggested"] = True
+        added += 1
+        log.info(f"[GroceryTracker] {est.get('n')} väntas ta slut {fc['runout']} – lagd i inköpslistan")
+    return added
+
+# ─── Svinnstatistik ──────────────────────────────────────────────────────────
+# Rollups per produkt, kategori, källa, ISO-vecka och månad uppdateras
+# inkrementellt för varje ny svinnrad (_commit_change) och sparas i lagerfilen
+# under "waste_stats". Saknas de (eller har äldre version) byggs de en gång från
+# hela waste_log; grocery_refresh bygger om dem eftersom filen kan ha ändrats.
+
+WASTE_STATS_VERSION = 1
+WASTE_TOP_N         = 10    # produkter/kategorier i sensorn
+WASTE_SERIES_N      = 12    # veckor/månader i sensorn
+WASTE_NO_CATEGORY   = "okategoriserad"
+WASTE_GROUPS        = ("product", "category", "source", "week", "month")
+
+@pyscript_compile
+def _new_waste_stats():
+    return {
+        "version": WASTE_STATS_VERSION, "count": 0,
+        "product": {}, "category": {}, "source": {}, "week": {}, "month": {},
+    }
+
+@pyscript_compile
+def _rollup_waste(stats, entry):
+    """Räkna in en svinnrad i rollup-tabellerna (O(1))."""
+    from datetime import date
+    day  = str(entry.get("date") or "")[:10]
+    name = entry.get("name") or "?"
+    key  = entry.get("barcode") or "name:" + name.lower()
+    stats["count"] += 1
+    row = stats["product"].get(key)
+    if row is None:
+        row = {"n": name, "c": 0, "last": ""}
+        stats["product"][key] = row
+    row["n"] = name
+    row["c"] += 1
+    row["last"] = max(row["last"], day)
+    cat = entry.get("category") or WASTE_NO_CATEGORY
+    stats["category"][cat] = stats["category"].get(cat, 0) + 1
+    src = entry.get("source") or "mobile"
+    stats["source"][src] = stats["source"].get(src, 0) + 1
+    try:
+        year, week, _day = date.fromisoformat(day).isocalendar()
+    except ValueError:
+        return
+    wk = f"{year}-W{week:02d}"
+    stats["week"][wk] = stats["week"].get(wk, 0) + 1
+    stats["month"][day[:7]] = stats["month"].get(day[:7], 0) + 1
+
+@pyscript_compile
+def _backfill_waste_stats(waste_log):
+    """Bygg rollups från hela svinnloggen (engångs, körs via task.executor)."""
+    stats = _new_waste_stats()
+    for entry in waste_log:
+        _rollup_waste(stats, entry)
+    return stats
+
+@pyscript_compile
+def _waste_rows(stats, group, limit=None):
+    """Rader [{"k", "n", "c"}] för en grupp – störst först, veckor/månader senast först."""
+    import heapq
+    table = stats.get(group, {})
+    if group == "product":
+        rows = [{"k": k, "n": v["n"], "c": v["c"], "last": v["last"]} for k, v in table.items()]
+        key = lambda r: (r["c"], r["last"])
+    else:
+        rows = [{"k": k, "n": k, "c": v} for k, v in table.items()]
+        key = (lambda r: r["k"]) if group in ("week", "month") else (lambda r: r["c"])
+    if limit:
+        return heapq.nlargest(limit, rows, key=key)
+    return sorted(rows, key=key, reverse=True)
+
+@pyscript_compile
+def _waste_view(stats):
+    """Kompakt sensorvy av rollups."""
+    from datetime import date
+    today = date.today()
+    year, week, _day = today.isocalendar()
+    return {
+        "count":        stats["count"],
+        "products":     len(stats["product"]),
+        "this_week":    stats["week"].get(f"{year}-W{week:02d}", 0),
+        "this_month":   stats["month"].get(today.isoformat()[:7], 0),
+        "top_products": [{"n": r["n"], "c": r["c"]} for r in _waste_rows(stats, "product", WASTE_TOP_N)],
+        "categories":   {r["k"]: r["c"] for r in _waste_rows(stats, "category", WASTE_TOP_N)},
+        "sources":      dict(stats["source"]),
+        "weeks":        {r["k"]: r["c"] for r in reversed(_waste_rows(stats, "week", WASTE_SERIES_N))},
+        "months":       {r["k"]: r["c"] for r in reversed(_waste_rows(stats, "month", WASTE_SERIES_N))},
+    }
+
+async def _ensure_waste_stats(inventory, rebuild=False):
+    """Rollups som matchar waste_log – bygg från loggen om de saknas eller rebuild=True."""
+    stats = inventory.get("waste_stats")
+    if rebuild or not stats or stats.get("version") != WASTE_STATS_VERSION:
+        stats = await task.executor(_backfill_waste_stats, list(inventory.get("waste_log", [])))
+        inventory["waste_stats"] = stats
+        log.info(f"[GroceryTracker] Svinnstatistik byggd från {stats['count']} loggrader")
+        return stats, True
+    return stats, False
+
 # ─── Sensoruppdatering ────────────────────────────────────────────────────────
 
 async def _refresh_sensors(inventory):
-    stats = _compute_stats(inventory)
+    lead = _get_runout_lead_days()
+    items = _copy_items(inventory.get("items", []))
+    forecasts = await task.executor(
+        _runout_forecasts, {b: dict(e) for b, e in inventory.get("consumption", {}).items()}, items, lead,
+    )
+    runout_barcodes = {f["b"] for f in forecasts if f["soon"] and f["stock"] > 0}
+    stats = await task.executor(_compute_stats, {"items": items}, runout_barcodes)
+    wire  = await task.executor(_wire_view, stats)
     state.set(
         "sensor.grocery_total_items",
         stats["total"],
@@ -180,7 +765,11 @@ async def _refresh_sensors(inventory):
             "friendly_name": "Matvaror i lager",
             "icon": "mdi:fridge",
             "unit_of_measurement": "st",
-            "items": stats["items"],
+            "items": wire["table"],
+            "ids": wire["total"],
+            "revision": inventory.get("revision", 0),
+            "refreshes": dict(_refresh_stats),
+            "truncated": stats["total"] > SENSOR_PREVIEW_N,
         },
     )
     state.set(
@@ -190,7 +779,9 @@ async def _refresh_sensors(inventory):
             "friendly_name": "Går ut inom 2 dagar",
             "icon": "mdi:clock-alert-outline",
             "unit_of_measurement": "st",
-            "items": stats["expiring_soon"],
+            "next_transition": _next_expiry_transition(),
+            "ids": wire["expiring_soon"],
+            "truncated": len(stats["expiring_soon"]) > SENSOR_PREVIEW_N,
         },
     )
     state.set(
@@ -200,7 +791,8 @@ async def _refresh_sensors(inventory):
             "friendly_name": "Utgångna varor",
             "icon": "mdi:alert-circle-outline",
             "unit_of_measurement": "st",
-            "items": stats["expired"],
+            "ids": wire["expired"],
+            "truncated": len(stats["expired"]) > SENSOR_PREVIEW_N,
         },
     )
     state.set(
@@ -210,9 +802,26 @@ async def _refresh_sensors(inventory):
             "friendly_name": "Lågt lager",
             "icon": "mdi:package-variant-minus",
             "unit_of_measurement": "st",
-            "items": stats["low_stock"],
+            "ids": wire["low_stock"],
+            "truncated": len(stats["low_stock"]) > SENSOR_PREVIEW_N,
         },
     )
+    labels = {"kyl": "Kyl", "frys": "Frys", "skafferi": "Skafferi"}
+    icons  = {"kyl": "mdi:fridge-outline", "frys": "mdi:snowflake", "skafferi": "mdi:cupboard-outline"}
+    for loc, view in stats["locations"].items():
+        state.set(
+            f"sensor.grocery_location_{loc}",
+            view["count"],
+            {
+                "friendly_name": f"Lager – {labels.get(loc, loc)}",
+                "icon": icons.get(loc, "mdi:map-marker"),
+                "unit_of_measurement": "st",
+                "quantity": view["quantity"],
+                "pct": view["pct"],
+                "ids": wire["locations"][loc],
+                "truncated": view["count"] > len(view["top"]),
+            },
+        )
     state.set(
         "sensor.grocery_waste_log",
         len(inventory.get("waste_log", [])),
@@ -220,9 +829,203 @@ async def _refresh_sensors(inventory):
             "friendly_name": "Matsvinn totalt",
             "icon": "mdi:trash-can-outline",
             "unit_of_measurement": "st",
-            "log": inventory.get("waste_log", [])[-100:],
+            "log": [_encode_waste(e) for e in inventory.get("waste_log", [])[-100:]],
+        },
+    )
+    state.set(
+        "sensor.grocery_runout_forecast",
+        len([f for f in forecasts if f["soon"]]),
+        {
+            "friendly_name": "Tar snart slut (prognos)",
+            "icon": "mdi:chart-timeline-variant-shimmer",
+            "unit_of_measurement": "st",
+            "lead_days": lead,
+            "forecasts": forecasts[:RUNOUT_SENSOR_N],
         },
     )
+    # Små tabeller som ändras på event-loopen – läses direkt, inte via executor
+    waste = _waste_view(inventory.get("waste_stats") or _new_waste_stats())
+    state.set(
+        "sensor.grocery_waste_stats",
+        waste.pop("count"),
+        dict(waste, friendly_name="Matsvinn – statistik", icon="mdi:chart-bar", unit_of_measurement="st"),
+    )
+
+# ─── Schemalagd sensoruppdatering ────────────────────────────────────────────
+# Ändringar markerar sensorerna som smutsiga i stället för att räkna om direkt.
+# Publicering sker högst en gång per input_number.grocery_refresh_interval
+# sekunder: första ändringen efter en lugn period publiceras direkt (leading
+# edge), ändringar inom intervallet slås ihop till en publicering när det gått
+# ut (trailing edge). grocery_refresh och startup tvingar omedelbar publicering.
+
+DEFAULT_REFRESH_INTERVAL = 2.0
+
+_refresh_state = {"dirty": False, "pending": False, "last": 0.0}
+_refresh_stats = {"requested": 0, "published": 0, "coalesced": 0, "forced": 0}
+
+def _get_refresh_interval():
+    """Minsta tid (s) mellan sensorpubliceringar (input_number.grocery_refresh_interval)."""
+    try:
+        return max(0.0, float(_sget("input_number.grocery_refresh_interval", DEFAULT_REFRESH_INTERVAL)))
+    except (ValueError, TypeError):
+        return DEFAULT_REFRESH_INTERVAL
+
+async def _publish_sensors():
+    import time
+    _refresh_state["dirty"] = False
+    _refresh_state["last"]  = time.monotonic()
+    _refresh_stats["published"] += 1
+    await _refresh_sensors(await _load_inventory())
+
+async def _trailing_refresh():
+    import time
+    try:
+        while True:
+            wait = _refresh_state["last"] + _get_refresh_interval() - time.monotonic()
+            if wait <= 0:
+                break
+            task.sleep(wait)
+        if _refresh_state["dirty"]:
+            await _publish_sensors()
+    finally:
+        _refresh_state["pending"] = False
+
+async def _request_refresh(force=False):
+    """Be om sensoruppdatering – direkt, eller sammanslagen med efterföljande ändringar."""
+    import time
+    _refresh_stats["requested"] += 1
+    if force:
+        _refresh_stats["forced"] += 1
+        await _publish_sensors()
+        return
+    idle = time.monotonic() - _refresh_state["last"] >= _get_refresh_interval()
+    if idle and not _refresh_state["pending"]:
+        await _publish_sensors()
+        return
+    _refresh_state["dirty"] = True
+    _refresh_stats["coalesced"] += 1
+    if not _refresh_state["pending"]:
+        _refresh_state["pending"] = True
+        task.create(_trailing_refresh)
+
+# ─── Ändringshändelser ───────────────────────────────────────────────────────
+# Varje muterande service går via _commit_change: revisionen ökas (sparas i
+# lagerfilen så att den aldrig går bakåt), lagret sparas, sensoruppdatering
+# begärs (_request_refresh) och grocery_inventory_changed skickas med en minimal patch i trådformatet:
+#   {"revision", "added": [kompakt vara], "updated": {id: {kort nyckel: värde}},
+#    "removed": [id], "waste": [kompakt svinnrad], "reset": bool}
+# En klient som ser ett glapp i revisionen (eller reset) hämtar om från
+# grocery_query_items.
+
+async def _commit_change(inventory, added=None, updated=None, removed=None, waste=None, reset=False, force=False):
+    inventory["revision"] = int(inventory.get("revision", 0)) + 1
+    # Nya svinnrader finns redan i waste_log – vid ombygge räknas de in där
+    _stats, rebuilt = await _ensure_waste_stats(inventory, rebuild=reset)
+    if not rebuilt:
+        for entry in waste or []:
+            _rollup_waste(inventory["waste_stats"], entry)
+    await _save_inventory(inventory)
+    await _request_refresh(force)
+    if _expiry_changed(inventory, added or [], updated or {}, removed or [], reset):
+        _wake_expiry_timer()
+    event.fire(
+        "grocery_inventory_changed",
+        revision=inventory["revision"],
+        added=[_encode_item(i) for i in (added or [])],
+        updated={item_id: _encode_fields(fields) for item_id, fields in (updated or {}).items()},
+        removed=list(removed or []),
+        waste=[_encode_waste(w) for w in (waste or [])],
+        reset=reset,
+    )
+
+# ─── Notis-sammanslagning ────────────────────────────────────────────────────
+# Vid uppackning skannas många varor i följd. Notiser buffras per
+# notification_id och skickas när det varit tyst i input_number.grocery_notify_window
+# sekunder (burst slut), eller senast efter NOTIFY_MAX_HOLD. En ensam notis
+# skickas oförändrad; flera blir en sammanfattning ("12 varor tillagda: …").
+# Fönster 0 = ingen sammanslagning.
+
+DEFAULT_NOTIFY_WINDOW = 3.0
+NOTIFY_MAX_HOLD       = 30.0
+NOTIFY_LIST_MAX       = 8
+
+# Sammanfattningsrubrik och rad (singular, plural) per typ
+_NOTIFY_KINDS = {
+    "add":    ("✅ Tillagda i lager", "{n} vara tillagd",   "{n} varor tillagda"),
+    "remove": ("🗑️ Borttagna",       "{n} vara borttagen", "{n} varor borttagna"),
+    "waste":  ("🗑️ Svinn loggat",    "{n} svinn loggat",   "{n} svinn loggade"),
+}
+
+_notify_buffers = {}    # notification_id → {"entries", "first", "last"}
+
+def _get_notify_window():
+    """Tyst tid (s) som avslutar en burst (input_number.grocery_notify_window)."""
+    try:
+        return max(0.0, float(_sget("input_number.grocery_notify_window", DEFAULT_NOTIFY_WINDOW)))
+    except (ValueError, TypeError):
+        return DEFAULT_NOTIFY_WINDOW
+
+def _summarize_notifications(entries):
+    """Buffrade notiser → (title, message)."""
+    if len(entries) == 1:
+        return entries[0]["title"], entries[0]["message"]
+    by_kind = {}
+    for e in entries:
+        by_kind.setdefault(e["kind"], []).append(e["short"])
+    lines = []
+    for kind, shorts in by_kind.items():
+        forms = _NOTIFY_KINDS.get(kind, ("", "{n} händelse", "{n} händelser"))
+        head = (forms[1] if len(shorts) == 1 else forms[2]).format(n=len(shorts))
+        listed = ", ".join(shorts[:NOTIFY_LIST_MAX])
+        more = f" … och {len(shorts) - NOTIFY_LIST_MAX} till" if len(shorts) > NOTIFY_LIST_MAX else ""
+        lines.append(f"{head}: {listed}{more}")
+    if len(by_kind) == 1:
+        title = _NOTIFY_KINDS.get(list(by_kind)[0], ("📦 Lageruppdatering",))[0]
+    else:
+        title = "📦 Lageruppdatering"
+    return title, "\n".join(lines)
+
+def _flush_notifications(notification_id):
+    buf = _notify_buffers.pop(notification_id, None)
+    if not buf or not buf["entries"]:
+        return
+    title, message = _summarize_notifications(buf["entries"])
+    persistent_notification.create(title=title, message=message, notification_id=notification_id)
+
+async def _notify_flusher(notification_id):
+    """Vänta tills bursten är slut (eller NOTIFY_MAX_HOLD) och skicka."""
+    import time
+    while True:
+        buf = _notify_buffers.get(notification_id)
+        if not buf:
+            return
+        now = time.monotonic()
+        due = min(buf["last"] + _get_notify_window(), buf["first"] + NOTIFY_MAX_HOLD)
+        if now >= due:
+            _flush_notifications(notification_id)
+            return
+        task.sleep(due - now)
+
+def _notify(notification_id, title, message, kind, short):
+    """Köa en notis för sammanslagning. short = kort text i sammanfattningen."""
+    import time
+    if _get_notify_window() <= 0:
+        persistent_notification.create(title=title, message=message, notification_id=notification_id)
+        return
+    now = time.monotonic()
+    buf = _notify_buffers.get(notification_id)
+    entry = {"title": title, "message": message, "kind": kind, "short": short}
+    if buf:
+        buf["entries"].append(entry)
+        buf["last"] = now
+        return
+    _notify_buffers[notification_id] = {"entries": [entry], "first": now, "last": now}
+    task.create(_notify_flusher, notification_id)
+
+@time_trigger("shutdown")
+def _flush_all_notifications():
+    for notification_id in list(_notify_buffers):
+        _flush_notifications(notification_id)
 
 # ─── Services ────────────────────────────────────────────────────────────────
 
@@ -236,37 +1039,34 @@ async def grocery_scan_add(barcode=None, quantity=1, expiry_date=None, source="m
     barcode = str(barcode).strip()
     log.info(f"[GroceryTracker] Lägger till: {barcode} (källa: {source})")
 
-    off_data = await _fetch_off(barcode)
-    product = _parse_off(off_data)
+    inventory, product, _source = await _resolve_product(barcode)
     name = name_override or product.get("name") or f"Okänd vara ({barcode})"
     category = product.get("category", "")
     image_url = product.get("image_url", "")
 
-    inventory = await _load_inventory()
-
-    found = False
+    found = None
     for item in inventory["items"]:
         if item["barcode"] == barcode and item.get("expiry_date") == expiry_date:
             item["quantity"] += int(quantity)
             # Varan finns igen – återställ shopping-list-flaggan
             item["shopping_list_suggested"] = False
-            found = True
+            found = item
             break
 
-    if not found:
+    if found:
+        _record_restock(inventory, barcode, int(quantity))
+        await _commit_change(inventory, updated={found["id"]: {
+            "quantity": found["quantity"], "shopping_list_suggested": False,
+        }})
+    else:
         new_item = _make_item(barcode, name, quantity, "st", expiry_date, category, source, image_url, location=location)
         inventory["items"].append(new_item)
-
-    await _save_inventory(inventory)
-    await _refresh_sensors(inventory)
+        _record_restock(inventory, barcode, int(quantity))
+        await _commit_change(inventory, added=[new_item])
 
     qty_txt = f" ×{quantity}" if int(quantity) > 1 else ""
     exp_txt = f" (bäst före {expiry_date})" if expiry_date else ""
-    persistent_notification.create(
-        title="✅ Tillagd i lager",
-        message=f"{name}{qty_txt}{exp_txt}",
-        notification_id="grocery_action",
-    )
+    _notify("grocery_action", "✅ Tillagd i lager", f"{name}{qty_txt}{exp_txt}", "add", f"{name}{qty_txt}")
 
 
 @service
@@ -289,34 +1089,37 @@ async def grocery_scan_remove(barcode=None, source="mobile"):
 
     if not found_item:
         # Varan finns inte i lager – logga ändå som svinn via OFF-lookup
-        off_data = await _fetch_off(barcode)
-        product = _parse_off(off_data)
+        product = _known_product(inventory, barcode)
+        if product is None:
+            product, _cached = await _lookup_product(barcode)
         unknown_name = product.get("name") or f"Okänd vara ({barcode})"
         from datetime import datetime
-        inventory["waste_log"].append({
+        entry = {
             "date": datetime.now().isoformat()[:10],
             "name": unknown_name,
             "barcode": barcode,
             "source": source,
-        })
-        await _save_inventory(inventory)
-        await _refresh_sensors(inventory)
-        persistent_notification.create(
-            title="🗑️ Svinn loggat",
-            message=f"{unknown_name} (ej i lager – loggad i svinndagboken)",
-            notification_id="grocery_action",
+            "category": product.get("category", ""),
+        }
+        inventory["waste_log"].append(entry)
+        await _commit_change(inventory, waste=[entry])
+        _notify(
+            "grocery_action", "🗑️ Svinn loggat",
+            f"{unknown_name} (ej i lager – loggad i svinndagboken)", "waste", unknown_name,
         )
         return
 
     found_item["quantity"] -= 1
 
     from datetime import datetime
-    inventory["waste_log"].append({
+    entry = {
         "date": datetime.now().isoformat()[:10],
         "name": found_item["name"],
         "barcode": barcode,
         "source": source,
-    })
+        "category": found_item.get("category", ""),
+    }
+    inventory["waste_log"].append(entry)
 
     add_to_list = False
     low_stock_alert = False
@@ -328,10 +1131,21 @@ async def grocery_scan_remove(barcode=None, source="mobile"):
         if min_qty > 0 and found_item["quantity"] <= min_qty:
             low_stock_alert = True
 
-    await _save_inventory(inventory)
-    await _refresh_sensors(inventory)
+    _record_consumption(inventory, barcode, found_item["name"], 1)
+    runout_alert = False
+    if not add_to_list and not low_stock_alert:
+        # Prognosen kan säga "snart slut" innan min_quantity nås
+        runout_alert = await _suggest_runouts(inventory, [barcode]) > 0
+    elif barcode in inventory.get("consumption", {}):
+        inventory["consumption"][barcode]["suggested"] = True
+
+    if add_to_list:
+        await _commit_change(inventory, removed=[found_item["id"]], waste=[entry])
+    else:
+        await _commit_change(inventory, updated={found_item["id"]: {"quantity": found_item["quantity"]}}, waste=[entry])
 
     # Lägg till i inköpslistan när sista exemplaret förbrukats eller vid lågt lager
+    # (_add_to_shopping_list hoppar över namn som redan finns på listan)
     if add_to_list:
         await _add_to_shopping_list(found_item["name"])
     elif low_stock_alert:
@@ -341,13 +1155,12 @@ async def grocery_scan_remove(barcode=None, source="mobile"):
         remain_txt = " – lagd till i inköpslistan 🛒"
     elif low_stock_alert:
         remain_txt = f" ({found_item['quantity']} kvar) ⚠️ Lågt lager – lagd till i inköpslistan"
+    elif runout_alert:
+        remain_txt = f" ({found_item['quantity']} kvar) 📉 Tar snart slut – lagd till i inköpslistan"
     else:
         remain_txt = f" ({found_item['quantity']} kvar)"
-    persistent_notification.create(
-        title="🗑️ Borttagen",
-        message=f"{found_item['name']}{remain_txt}",
-        notification_id="grocery_action",
-    )
+    short = found_item["name"] + (" 🛒" if add_to_list or low_stock_alert or runout_alert else "")
+    _notify("grocery_action", "🗑️ Borttagen", f"{found_item['name']}{remain_txt}", "remove", short)
 
 
 @service
@@ -362,15 +1175,11 @@ async def grocery_manual_add(
     inventory = await _load_inventory()
     new_item = _make_item(barcode or "", name, quantity, unit, expiry_date, category, "manual", "", min_quantity=min_quantity, location=location)
     inventory["items"].append(new_item)
-    await _save_inventory(inventory)
-    await _refresh_sensors(inventory)
+    _record_restock(inventory, new_item["barcode"], new_item["quantity"])
+    await _commit_change(inventory, added=[new_item])
 
     qty_txt = f"{quantity} {unit} " if unit != "st" else (f"×{quantity} " if int(quantity) > 1 else "")
-    persistent_notification.create(
-        title="✅ Manuellt tillagd",
-        message=f"{qty_txt}{name}",
-        notification_id="grocery_action",
-    )
+    _notify("grocery_action", "✅ Manuellt tillagd", f"{qty_txt}{name}", "add", f"{qty_txt}{name}")
 
 
 @service
@@ -386,14 +1195,20 @@ async def grocery_manual_remove(item_id=None):
     if removed:
         from datetime import datetime
         item = removed[0]
-        inventory["waste_log"].append({
+        entry = {
             "date": datetime.now().isoformat()[:10],
             "name": item["name"],
             "barcode": item.get("barcode", ""),
             "source": "manual_remove",
-        })
-        await _save_inventory(inventory)
-        await _refresh_sensors(inventory)
+            "category": item.get("category", ""),
+        }
+        inventory["waste_log"].append(entry)
+        # Hela posten tas bort (ofta svinn) – ingen förbrukning, men varan ska
+        # inte föreslås igen förrän den fyllts på
+        if item.get("barcode") in inventory.get("consumption", {}):
+            inventory["consumption"][item["barcode"]]["suggested"] = True
+            _schedule_runout(inventory, item["barcode"])
+        await _commit_change(inventory, removed=[item["id"]], waste=[entry])
         await _add_to_shopping_list(item["name"])
 
 
@@ -408,20 +1223,95 @@ async def grocery_set_expiry(item_id=None, expiry_date=None):
         if item["id"] == str(item_id):
             item["expiry_date"] = expiry_date
             item["shopping_list_suggested"] = False  # Nytt datum → återställ flagga
+            await _commit_change(inventory, updated={item["id"]: {
+                "expiry_date": expiry_date, "shopping_list_suggested": False,
+            }})
             break
 
-    await _save_inventory(inventory)
-    await _refresh_sensors(inventory)
-
 
 @service
 async def grocery_refresh():
     """Ladda om lagret från fil och uppdatera sensorer."""
-    inventory = await _load_inventory()
-    await _refresh_sensors(inventory)
+    inventory = await _load_inventory(reload=True)
+    # Filen kan ha ändrats utanför pyscript – klienter hämtar om allt
+    await _commit_change(inventory, reset=True, force=True)
     log.info("[GroceryTracker] Lager omladdad.")
 
 
+@service(supports_response="only")
+async def grocery_query_items(location=None, category=None, expiring_within_days=None,
+                              search=None, sort="status", offset=0, limit=QUERY_DEFAULT_LIMIT,
+                              compact=False):
+    """Sök i lagret med filter, sortering och sidindelning (svar från service).
+
+    Args:
+        location: kyl, frys eller skafferi (None = alla)
+        category: delsträng i kategori
+        expiring_within_days: bara varor som går ut inom N dagar (inkl. utgångna)
+        search: delsträng i namn eller exakt streckkod
+        sort: status, expiry, name, added, quantity ("-" prefix = fallande)
+        offset, limit: sidindelning (max 200 per anrop)
+        compact: varor i kompakt trådformat (ITEM_WIRE_KEYS)
+    """
+    inventory = await _load_inventory()
+    try:
+        page = await task.executor(
+            _query_items, _copy_items(inventory.get("items", [])), location, category,
+            expiring_within_days, search, sort, offset, limit,
+        )
+    except (ValueError, TypeError) as e:
+        log.warning(f"[GroceryTracker] grocery_query_items: ogiltiga parametrar ({e})")
+        return {"items": [], "total": 0, "offset": 0, "limit": 0, "error": str(e)}
+    if compact:
+        page["items"] = [_encode_item(i) for i in page["items"]]
+    page["revision"] = inventory.get("revision", 0)
+    return page
+
+
+@service(supports_response="only")
+async def grocery_lookup_product(barcode=None):
+    """Slå upp en streckkod (svar från service) – samma väg som grocery_scan_add:
+    känd vara i lager/svinnlogg först, annars serverns OFF-uppslag och cache.
+
+    Svar: {"barcode", "found", "name", "brands", "category", "image_url", "cached", "known"}
+    """
+    if not barcode:
+        return {"barcode": "", "found": False, "error": "barcode saknas"}
+    barcode = str(barcode).strip()
+    _inventory, product, source = await _resolve_product(barcode)
+    return {
+        "barcode":   barcode,
+        "found":     bool(product.get("name")),
+        "name":      product.get("name", ""),
+        "brands":    product.get("brands", ""),
+        "category":  product.get("category", ""),
+        "image_url": product.get("image_url", ""),
+        "cached":    source != "off",
+        "known":     source == "known",
+    }
+
+
+@service(supports_response="only")
+async def grocery_waste_stats(group="product", limit=20):
+    """Svinnstatistik per grupp ur rollup-tabellerna (svar från service).
+
+    Args:
+        group: product, category, source, week eller month
+        limit: max antal rader (0 = alla)
+    Svar: {"group", "count", "rows": [{"k", "n", "c"}]} – veckor/månader senast först.
+    """
+    if group not in WASTE_GROUPS:
+        return {"group": group, "count": 0, "rows": [], "error": f"okänd grupp – välj {', '.join(WASTE_GROUPS)}"}
+    inventory = await _load_inventory()
+    stats, _rebuilt = await _ensure_waste_stats(inventory)
+    try:
+        limit = max(0, int(limit or 0))
+    except (ValueError, TypeError):
+        limit = 20
+    rows = _waste_rows(stats, group, limit)
+    return {"group": group, "count": stats["count"], "rows": rows}
+
+
 @service
 async def grocery_push_shopping_list():
     """Hämta inköpslistan och skicka som push-notis till alla enheter."""
@@ -448,7 +1338,7 @@ async def grocery_push_shopping_list():
 async def grocery_generate_shopping_list():
     """Lägg manuellt till alla utgångna/snart utgångna varor i inköpslistan."""
     inventory = await _load_inventory()
-    stats = _compute_stats(inventory)
+    stats = await task.executor(_compute_stats, {"items": _copy_items(inventory.get("items", []))})
     candidates = stats["expired"] + stats["expiring_soon"]
 
     if not candidates:
@@ -465,7 +1355,9 @@ async def grocery_generate_shopping_list():
         item["shopping_list_suggested"] = True
         added.append(item["name"])
 
-    await _save_inventory(inventory)
+    await _commit_change(inventory, updated={
+        item["id"]: {"shopping_list_suggested": True} for item in candidates
+    })
 
     persistent_notification.create(
         title="🛒 Inköpslista uppdaterad",
@@ -486,9 +1378,8 @@ async def grocery_set_min_quantity(item_id=None, min_quantity=0):
     for item in inventory["items"]:
         if item["id"] == str(item_id):
             item["min_quantity"] = int(min_quantity) if min_quantity else 0
+            await _commit_change(inventory, updated={item["id"]: {"min_quantity": item["min_quantity"]}})
             break
-    await _save_inventory(inventory)
-    await _refresh_sensors(inventory)
 
 
 @service
@@ -500,34 +1391,175 @@ async def grocery_set_location(item_id=None, location="kyl"):
     for item in inventory["items"]:
         if item["id"] == str(item_id):
             item["location"] = str(location) if location else "kyl"
+            await _commit_change(inventory, updated={item["id"]: {"location": item["location"]}})
             break
-    await _save_inventory(inventory)
-    await _refresh_sensors(inventory)
 
 
-# ─── Daglig påminnelse kl 16:00 ─────────────────────────────────────────────
+# ─── Utgångstimer ────────────────────────────────────────────────────────────
+# I stället för en daglig helskanning vet schemaläggaren nästa hinkövergång
+# för varje vara: "snart utgången" från midnatt EXPIRING_SOON_DAYS dagar före
+# bäst-före, "utgången" från midnatten efter. Övergångarna ligger i en heap och
+# timern sover till nästa övergång. Vid övergång flyttas varan mellan hinkarna,
+# sensorerna uppdateras och varan läggs i inköpslistan (en gång per vara).
+# _commit_change schemalägger om inkrementellt vid tillägg, borttagning och
+# ändrat bäst-före-datum; poster för ändrade/borttagna varor ogiltigförklaras
+# lat via generationsnummer.
 
-@time_trigger("cron(0 16 * * *)")
-async def _daily_expiry_check():
-    inventory = await _load_inventory()
-    stats = _compute_stats(inventory)
+EXPIRY_MAX_SLEEP = 6 * 3600   # vakna ändå så här ofta (klockjustering, sommartid)
 
-    expiring = stats["expiring_soon"]
-    expired = stats["expired"]
+_expiry_heap    = []   # (ISO-datum, generation, item_id, hink)
+_expiry_gen     = {}   # item_id → generation som gäller
+_expiry_buckets = {"expiring_soon": set(), "expired": set()}
+_expiry_seq     = {"n": 0}
+_expiry_timer_state = {"running": False, "until": None}   # until = datum timern sover mot
 
-    if not expiring and not expired:
-        return
+@pyscript_compile
+def _expiry_transitions(expiry_date, today):
+    """Hinkövergångar [(ISO-datum, hink)] från och med idag.
 
-    # Lägg till utgångna/snart utgångna i inköpslistan (en gång per vara)
-    list_changed = False
-    for item in expired + expiring:
+    Redan passerade övergångar ersätts av den nuvarande hinken med dagens datum,
+    så att de hanteras direkt. Samma gränser som _compute_stats.
+    """
+    from datetime import date, timedelta
+    try:
+        exp = date.fromisoformat(str(expiry_date)[:10])
+    except ValueError:
+        return []
+    soon_at    = exp - timedelta(days=EXPIRING_SOON_DAYS)
+    expired_at = exp + timedelta(days=1)
+    if expired_at <= today:
+        return [(today.isoformat(), "expired")]
+    return [(max(soon_at, today).isoformat(), "expiring_soon"), (expired_at.isoformat(), "expired")]
+
+def _schedule_expiry(item):
+    """Lägg (om) en varas övergångar i heapen. Tidigare poster blir ogiltiga."""
+    import heapq
+    from datetime import date
+    _unschedule_expiry(item["id"])
+    if not item.get("expiry_date"):
+        return
+    _expiry_seq["n"] += 1
+    gen = _expiry_seq["n"]
+    _expiry_gen[item["id"]] = gen
+    for when, bucket in _expiry_transitions(item["expiry_date"], date.today()):
+        heapq.heappush(_expiry_heap, (when, gen, item["id"], bucket))
+
+def _unschedule_expiry(item_id):
+    _expiry_gen.pop(item_id, None)
+    _expiry_buckets["expiring_soon"].discard(item_id)
+    _expiry_buckets["expired"].discard(item_id)
+
+def _rebuild_expiry(inventory):
+    """Bygg heapen från grunden (startup och omläsning från fil)."""
+    _expiry_heap.clear()
+    _expiry_gen.clear()
+    _expiry_buckets["expiring_soon"].clear()
+    _expiry_buckets["expired"].clear()
+    for item in inventory.get("items", []):
+        _schedule_expiry(item)
+    for barcode in inventory.get("consumption", {}):
+        _schedule_runout(inventory, barcode)
+    _expiry_timer_state["until"] = None
+    task.create(_expiry_timer)
+
+def _wake_expiry_timer():
+    """Starta timern om den inte körs, eller om den sover mot en senare övergång än heapens första.
+
+    En timer som just hanterar övergångar lämnas ifred – den läser heapen igen efteråt.
+    """
+    head = _next_expiry_transition()
+    if head is None:
+        return
+    until = _expiry_timer_state["until"]
+    if not _expiry_timer_state["running"] or (until is not None and head < until):
+        task.create(_expiry_timer)
+
+def _next_expiry_transition():
+    """Datum för nästa giltiga övergång (släpper ogiltiga poster i toppen), annars None."""
+    import heapq
+    while _expiry_heap and _expiry_gen.get(_expiry_heap[0][2]) != _expiry_heap[0][1]:
+        heapq.heappop(_expiry_heap)
+    return _expiry_heap[0][0] if _expiry_heap else None
+
+async def _expiry_timer():
+    """Sov till nästa övergång och hantera alla som infallit. Startas om vid ny tidigare post."""
+    task.unique("grocery_expiry_timer")
+    import heapq
+    from datetime import date, datetime
+    _expiry_timer_state["running"] = True
+    while True:
+        when = _next_expiry_transition()
+        if when is None:
+            _expiry_timer_state["running"] = False
+            _expiry_timer_state["until"] = None
+            return
+        wait = (datetime.fromisoformat(when) - datetime.now()).total_seconds()
+        if wait > 0:
+            _expiry_timer_state["until"] = when
+            task.sleep(min(wait, EXPIRY_MAX_SLEEP))
+            _expiry_timer_state["until"] = None
+            continue
+        today = date.today().isoformat()
+        due = {}
+        while _next_expiry_transition() is not None and _expiry_heap[0][0] <= today:
+            _when, _gen, item_id, bucket = heapq.heappop(_expiry_heap)
+            # Samma vara kan ha flera förfallna poster – den senaste hinken vinner
+            if bucket == "expired" or due.get(item_id) != "expired":
+                due[item_id] = bucket
+        if due:
+            await _on_expiry_transitions(due)
+
+async def _on_expiry_transitions(due):
+    """Flytta varor mellan hinkarna, uppdatera sensorer och föreslå i inköpslistan."""
+    runouts = [key[len("runout:"):] for key, bucket in due.items() if bucket == "runout"]
+    due = {key: bucket for key, bucket in due.items() if bucket != "runout"}
+    for item_id, bucket in due.items():
+        if bucket == "expired":
+            _expiry_buckets["expiring_soon"].discard(item_id)
+        _expiry_buckets[bucket].add(item_id)
+    inventory = await _load_inventory()
+    flagged = {}
+    for item in [i for i in inventory["items"] if i["id"] in due]:
         if not item.get("shopping_list_suggested"):
             await _add_to_shopping_list(item["name"])
             item["shopping_list_suggested"] = True
-            list_changed = True
+            flagged[item["id"]] = {"shopping_list_suggested": True}
+    suggested = await _suggest_runouts(inventory, runouts) if runouts else 0
+    if flagged or suggested:
+        await _commit_change(inventory, updated=flagged)
+    else:
+        await _request_refresh()
+    log.info(
+        f"[GroceryTracker] Utgångstimer: {len(due)} övergång(ar), {len(runouts)} slutprognos(er), "
+        f"{len(flagged) + suggested} till inköpslistan"
+    )
 
-    if list_changed:
-        await _save_inventory(inventory)
+def _expiry_changed(inventory, added, updated, removed, reset):
+    """Schemalägg om efter en ändring. Returnerar True om heapen fått nya poster."""
+    if reset:
+        _rebuild_expiry(inventory)
+        return False
+    touched = [i for i in added]
+    changed_ids = {item_id for item_id, fields in updated.items() if "expiry_date" in fields}
+    if changed_ids:
+        touched = touched + [i for i in inventory["items"] if i["id"] in changed_ids]
+    for item_id in removed:
+        _unschedule_expiry(item_id)
+    for item in touched:
+        _schedule_expiry(item)
+    return bool(touched)
+
+# ─── Daglig rapport kl 16:00 ─────────────────────────────────────────────────
+# Inköpslistan hanteras av utgångstimern; rapporten läser bara dess hinkar.
+
+@time_trigger("cron(0 16 * * *)")
+async def _daily_expiry_check():
+    inventory = await _load_inventory()
+    expiring = [i for i in inventory["items"] if i["id"] in _expiry_buckets["expiring_soon"]]
+    expired  = [i for i in inventory["items"] if i["id"] in _expiry_buckets["expired"]]
+
+    if not expiring and not expired:
+        return
 
     # Skicka daglig notis
     lines = []
@@ -933,7 +1965,7 @@ async def grocery_suggest_recipes(provider_override=None):
         return
 
     inventory = await _load_inventory()
-    stats = _compute_stats(inventory)
+    stats = await task.executor(_compute_stats, {"items": _copy_items(inventory.get("items", []))})
     candidates = stats["expired"] + stats["expiring_soon"]
 
     if not candidates:
@@ -1057,12 +2089,48 @@ async def grocery_stop_cooking():
     )
 
 
+# ─── Event-loop-fördröjning ──────────────────────────────────────────────────
+# Mäter hur mycket senare än planerat en kort sleep vaknar. Hög fördröjning betyder
+# att något (pyscript eller annan integration) blockerar HA:s event-loop.
+
+LOOP_LAG_INTERVAL = 0.5   # sekunder mellan mätningar
+LOOP_LAG_PUBLISH  = 60    # sekunder mellan sensoruppdateringar
+
+@time_trigger("startup")
+async def _loop_lag_monitor():
+    task.unique("grocery_loop_lag_monitor")
+    import time
+    samples = []
+    last_publish = time.monotonic()
+    while True:
+        t0 = time.monotonic()
+        task.sleep(LOOP_LAG_INTERVAL)
+        samples.append(max(0.0, (time.monotonic() - t0 - LOOP_LAG_INTERVAL) * 1000))
+        if time.monotonic() - last_publish >= LOOP_LAG_PUBLISH:
+            ordered = sorted(samples)
+            state.set("sensor.grocery_event_loop_lag", round(ordered[-1], 1), {
+                "friendly_name":       "Grocery – Event-loop-fördröjning (max)",
+                "icon":                "mdi:timer-alert-outline",
+                "unit_of_measurement": "ms",
+                "avg_ms":              round(sum(samples) / len(samples), 1),
+                "p95_ms":              round(ordered[int(len(ordered) * 0.95) - 1], 1),
+                "samples":             len(samples),
+                "window_s":            LOOP_LAG_PUBLISH,
+            })
+            samples = []
+            last_publish = time.monotonic()
+
+
 # ─── Startup ─────────────────────────────────────────────────────────────────
 
 @time_trigger("startup")
 async def _startup():
     inventory = await _load_inventory()
-    await _refresh_sensors(inventory)
+    _stats, backfilled = await _ensure_waste_stats(inventory)
+    if backfilled:
+        await _save_inventory(inventory)
+    await _request_refresh(force=True)
+    _rebuild_expiry(inventory)
     # Initiera recept-sensor (pyscript-states är transient – finns aldrig vid omstart)
     state.set("sensor.grocery_last_recipe", "Inget receptförslag ännu", {
         "recipe": "",
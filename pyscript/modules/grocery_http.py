@@ -0,0 +1,104 @@
+"""
+Grocery HTTP – gemensam hastighetsbegränsning + omförsök
+========================================================
+Delas av grocery_tracker.py (Open Food Facts) och grocery_offers.py
+(Matpriskollen). Token-bucket per värd: HTTP_RATE_LIMITS[värd] =
+(förfrågningar/s, burst). Nätverksfel, 429 och 5xx försöks om upp till
+HTTP_RETRIES gånger med exponentiell backoff + full jitter; Retry-After från
+servern respekteras.
+
+Hinkarna är gemensamma per värd oavsett anropande skript. Räknarna ägs av
+anroparen (new_stats()) så att varje skript kan publicera sina egna.
+"""
+
+HTTP_RATE_LIMITS   = {
+    "world.openfoodfacts.org": (1.0, 5),
+    "matpriskollen.se":        (2.0, 4),
+}
+HTTP_DEFAULT_RATE  = (1.0, 2)
+HTTP_RETRIES       = 3
+HTTP_BACKOFF_BASE  = 0.5    # sekunder, fördubblas per försök
+HTTP_BACKOFF_MAX   = 30.0
+HTTP_RETRY_STATUS  = (429, 500, 502, 503, 504)
+
+_buckets = {}   # värd → {"tokens", "ts"}
+
+
+def new_stats():
+    """Tomma räknare för get_json(stats=...)."""
+    return {"requests": 0, "retries": 0, "throttled": 0, "throttled_ms": 0, "failures": 0}
+
+
+async def throttle(host, stats):
+    """Vänta tills värdens token-bucket har en token och förbruka den."""
+    import time
+    rate, burst = HTTP_RATE_LIMITS.get(host, HTTP_DEFAULT_RATE)
+    while True:
+        now = time.monotonic()
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = {"tokens": float(burst), "ts": now}
+            _buckets[host] = bucket
+        bucket["tokens"] = min(float(burst), bucket["tokens"] + (now - bucket["ts"]) * rate)
+        bucket["ts"] = now
+        if bucket["tokens"] >= 1:
+            bucket["tokens"] -= 1
+            return
+        wait = (1 - bucket["tokens"]) / rate
+        stats["throttled"]    += 1
+        stats["throttled_ms"] += int(wait * 1000)
+        task.sleep(wait)
+
+
+def retry_after_s(value):
+    """Tolka Retry-After (sekunder eller HTTP-datum) till sekunder, None om ogiltig."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        from datetime import datetime, timezone
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+async def get_json(url, timeout, headers=None, stats=None, tag="Grocery"):
+    """GET med token-bucket per värd och omförsök. Returnerar {"status", "data", "headers"}.
+
+    data är tolkad JSON vid 200, annars None. headers är aiohttp:s skiftlägesokänsliga
+    CIMultiDictProxy (ETag/etag slås upp likadant). Kastar sista undantaget om alla
+    försök fallerar på nätverksfel.
+    """
+    import aiohttp
+    import asyncio
+    import random
+    from urllib.parse import urlparse
+    if stats is None:
+        stats = new_stats()
+    host = urlparse(url).hostname or ""
+    for attempt in range(HTTP_RETRIES + 1):
+        await throttle(host, stats)
+        stats["requests"] += 1
+        retry_after = None
+        try:
+            async with aiohttp.ClientSession() as sess:
+                async with sess.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    if resp.status not in HTTP_RETRY_STATUS or attempt == HTTP_RETRIES:
+                        data = await resp.json(content_type=None) if resp.status == 200 else None
+                        if resp.status in HTTP_RETRY_STATUS:
+                            stats["failures"] += 1
+                        return {"status": resp.status, "data": data, "headers": resp.headers}
+                    retry_after = retry_after_s(resp.headers.get("Retry-After"))
+                    log.debug(f"[{tag}] HTTP {resp.status} från {host} – försök {attempt + 1}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == HTTP_RETRIES:
+                stats["failures"] += 1
+                raise
+            log.debug(f"[{tag}] {host}: {e!r} – försök {attempt + 1}")
+        stats["retries"] += 1
+        backoff = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+        task.sleep(min(HTTP_BACKOFF_MAX, retry_after) if retry_after is not None else backoff)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Offer match bench – träffsäkerhet och hastighet för erbjudandematchningen
+=========================================================================
+Kör matchningen i pyscript/grocery_offers.py mot en märkt korpus
+(tools/offer_match_corpus.json) utan Home Assistant och rapporterar
+precision/recall per läge samt antal inköpslista-rader per sekund.
+
+Lägen:
+  exact    – _match_item_to_offers (ett svep över alla erbjudanden per rad)
+  indexed  – samma regler via förbyggt ordindex (_build_match_index)
+  fuzzy    – indexerad + trigram-likhet (DEFAULT_FUZZY_THRESHOLD)
+
+Resultatet jämförs med tools/offer_match_baseline.json:
+  - precision/recall får inte sjunka
+  - rader/s får inte sjunka mer än --speed-tolerance (standard 50 %, maskinberoende)
+
+Användning:
+  python tools/offer_match_bench.py                    – kör och jämför mot baseline
+  python tools/offer_match_bench.py --verbose          – visa felmatchningar per rad
+  python tools/offer_match_bench.py --update-baseline  – skriv ny baseline
+
+Avslutas med kod 1 vid regression (kan köras i CI).
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+import time
+
+ROOT          = pathlib.Path(__file__).resolve().parent.parent
+MODULE_FILE   = ROOT / "pyscript" / "grocery_offers.py"
+MODULES_DIR   = ROOT / "pyscript" / "modules"
+CORPUS_FILE   = ROOT / "tools" / "offer_match_corpus.json"
+BASELINE_FILE = ROOT / "tools" / "offer_match_baseline.json"
+
+# Korpusens erbjudanden upprepas över så här många fiktiva butiker vid hastighetsmätning
+SPEED_STORES  = 100
+SPEED_REPEATS = 3
+MODES = ("exact", "indexed", "fuzzy")
+
+
+class _Log:
+    """Tyst ersättning för pyscripts log."""
+    def __getattr__(self, _name):
+        return lambda *args, **kwargs: None
+
+
+def _load_module():
+    """Läs in grocery_offers.py med pyscripts dekoratorer ersatta av no-ops."""
+    def passthrough(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+    ns = {
+        "__name__":         "grocery_offers",
+        "pyscript_compile": passthrough,
+        "service":          passthrough,
+        "time_trigger":     passthrough,
+        "state_trigger":    passthrough,
+        "event_trigger":    passthrough,
+        "log":              _Log(),
+    }
+    # pyscript/modules importeras som vanliga moduler (pyscripts modulsökväg)
+    if str(MODULES_DIR) not in sys.path:
+        sys.path.insert(0, str(MODULES_DIR))
+    source = MODULE_FILE.read_text(encoding="utf-8")
+    exec(compile(source, str(MODULE_FILE), "exec"), ns)
+    return ns
+
+
+def _make_offers(mod, corpus, store_count):
+    """Bygg flat-lista [(butiksnamn, erbjudande-tuple)] och id per rad."""
+    flat = []
+    ids  = []
+    for s in range(store_count):
+        store_name = f"Butik {s + 1}"
+        for o in corpus["offers"]:
+            rec = [""] * 8
+            rec[mod["O_NAME"]]  = o["name"]
+            rec[mod["O_BRAND"]] = o.get("brand", "")
+            rec[mod["O_PRICE"]] = o.get("price", "10 kr")
+            flat.append((store_name, tuple(rec)))
+            ids.append(o["id"])
+    return flat, ids
+
+
+def _run_mode(mod, mode, item_names, flat):
+    """Kör matchningen i angivet läge. Returnerar {item: [(butik, produkt)]}."""
+    if mode == "exact":
+        matched = mod["_match_shopping_list"](item_names, flat)
+    else:
+        index = mod["_build_match_index"](flat)
+        matched = mod["_match_shopping_list"](
+            item_names, flat, index, mode == "fuzzy", mod["DEFAULT_FUZZY_THRESHOLD"]
+        )
+    return {m["item"]: [(o["store_name"], o["product"]) for o in m["offers"]] for m in matched}
+
+
+def _accuracy(mod, corpus, mode, verbose=False):
+    """Precision/recall över (rad, erbjudande)-par för en butik."""
+    flat, _ids = _make_offers(mod, corpus, 1)
+    name_to_id = {o["name"]: o["id"] for o in corpus["offers"]}
+    item_names = [c["item"] for c in corpus["cases"]]
+    result = _run_mode(mod, mode, item_names, flat)
+
+    tp = fp = fn = 0
+    misses = []
+    for case in corpus["cases"]:
+        got      = {name_to_id[product] for _store, product in result.get(case["item"], [])}
+        expected = set(case["expected"])
+        tp += len(got & expected)
+        fp += len(got - expected)
+        fn += len(expected - got)
+        if got != expected:
+            misses.append((case["item"], sorted(got - expected), sorted(expected - got)))
+
+    if verbose and misses:
+        print(f"  [{mode}] felmatchningar:")
+        for item, extra, missing in misses:
+            print(f"    {item:20s} fel: {', '.join(extra) or '–':20s} saknas: {', '.join(missing) or '–'}")
+
+    return {
+        "precision": round(tp / (tp + fp), 4) if tp + fp else 1.0,
+        "recall":    round(tp / (tp + fn), 4) if tp + fn else 1.0,
+        "cases_ok":  len(corpus["cases"]) - len(misses),
+    }
+
+
+def _throughput(mod, corpus, mode):
+    """Inköpslista-rader per sekund mot SPEED_STORES kopior av korpusens erbjudanden.
+
+    Indexbygget räknas in – det görs en gång per cacheversion i modulen, precis
+    som här en gång per körning.
+    """
+    flat, _ids = _make_offers(mod, corpus, SPEED_STORES)
+    item_names = [c["item"] for c in corpus["cases"]]
+    best = None
+    for _ in range(SPEED_REPEATS):
+        t0 = time.perf_counter()
+        _run_mode(mod, mode, item_names, flat)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return {"offers": len(flat), "items_per_s": round(len(item_names) / best, 1)}
+
+
+def _compare(results, baseline, speed_tolerance):
+    """Lista regressioner mot baseline."""
+    problems = []
+    for mode, res in results.items():
+        base = baseline.get(mode)
+        if not base:
+            continue
+        for key in ("precision", "recall"):
+            if res[key] + 1e-9 < base[key]:
+                problems.append(f"{mode}: {key} {res[key]} < baseline {base[key]}")
+        floor = base["items_per_s"] * (1 - speed_tolerance)
+        if res["items_per_s"] < floor:
+            problems.append(
+                f"{mode}: {res['items_per_s']} rader/s < {floor:.1f} "
+                f"(baseline {base['items_per_s']}, tolerans {speed_tolerance:.0%})"
+            )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Träffsäkerhet och hastighet för erbjudandematchningen")
+    parser.add_argument("--update-baseline", action="store_true", help="skriv resultatet som ny baseline")
+    parser.add_argument("--speed-tolerance", type=float, default=0.5, help="tillåten hastighetsförlust (0–1)")
+    parser.add_argument("--verbose", action="store_true", help="visa felmatchningar per rad")
+    args = parser.parse_args()
+
+    mod    = _load_module()
+    corpus = json.loads(CORPUS_FILE.read_text(encoding="utf-8"))
+
+    results = {}
+    for mode in MODES:
+        res = _accuracy(mod, corpus, mode, args.verbose)
+        res.update(_throughput(mod, corpus, mode))
+        results[mode] = res
+        print(
+            f"{mode:8s} precision {res['precision']:.3f}  recall {res['recall']:.3f}  "
+            f"rader ok {res['cases_ok']}/{len(corpus['cases'])}  "
+            f"{res['items_per_s']:.0f} rader/s ({res['offers']} erbjudanden)"
+        )
+
+    if args.update_baseline:
+        BASELINE_FILE.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline skriven till {BASELINE_FILE.relative_to(ROOT)}")
+        return 0
+
+    if not BASELINE_FILE.exists():
+        print("Ingen baseline – kör med --update-baseline")
+        return 0
+    problems = _compare(results, json.loads(BASELINE_FILE.read_text(encoding="utf-8")), args.speed_tolerance)
+    for p in problems:
+        print(f"REGRESSION {p}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
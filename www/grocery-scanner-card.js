@@ -17,8 +17,69 @@
  * Resurser: /local/grocery-scanner-card.js  (typ: JavaScript-modul)
  */
 
-const OFF_API = "https://world.openfoodfacts.org/api/v2/product/{barcode}.json";
-const OFF_HEADERS = { "User-Agent": "HomeAssistant-GroceryTracker/1.0" };
+// Lager-fliken hämtar varor sidvis via pyscript.grocery_query_items och håller
+// sedan sidan aktuell med patchar från händelsen grocery_inventory_changed.
+const INVENTORY_PAGE_SIZE = 50;
+// Sensorn uppdateras strax före händelsen – vänta så länge på patchen innan omhämtning
+const PATCH_GRACE_MS = 1500;
+
+// Kompakt trådformat (ITEM_WIRE_KEYS/ITEM_WIRE_DEFAULTS i grocery_tracker.py):
+// korta nycklar, fält med standardvärde utelämnas, OFF-bild-URL:er relativa ("mo").
+const ITEM_WIRE_KEYS = {
+  i: "id", b: "barcode", n: "name", c: "category", q: "quantity", u: "unit",
+  a: "added_date", e: "expiry_date", s: "source", m: "image_url",
+  sl: "shopping_list_suggested", mq: "min_quantity", l: "location",
+};
+const ITEM_WIRE_DEFAULTS = {
+  barcode: "", category: "", quantity: 1, unit: "st", expiry_date: null,
+  source: "mobile", image_url: "", shopping_list_suggested: false,
+  min_quantity: 0, location: "kyl",
+};
+const OFF_IMAGE_PREFIX = "https://images.openfoodfacts.org/images/products/";
+
+function decodeItem(row, id) {
+  const item = { ...ITEM_WIRE_DEFAULTS };
+  if (id !== undefined) item.id = id;
+  for (const [k, v] of Object.entries(row || {})) {
+    if (k === "mo") item.image_url = OFF_IMAGE_PREFIX + v;
+    else if (ITEM_WIRE_KEYS[k]) item[ITEM_WIRE_KEYS[k]] = v;
+  }
+  return item;
+}
+
+function decodeFields(row) {
+  const fields = {};
+  for (const [k, v] of Object.entries(row || {})) {
+    if (ITEM_WIRE_KEYS[k]) fields[ITEM_WIRE_KEYS[k]] = v;
+  }
+  return fields;
+}
+
+// Samma ordning som sort="status" i _query_items: utgångna → snart utgångna → lågt lager → övrigt
+function statusRank(item, today, soon) {
+  const exp = item.expiry_date || "";
+  if (exp && exp < today) return 0;
+  if (exp && exp <= soon) return 1;
+  if (item.min_quantity > 0 && item.quantity <= item.min_quantity) return 2;
+  return 3;
+}
+
+// Lokalt datum (YYYY-MM-DD) – toISOString() ger UTC och skiljer sig från
+// servern mellan midnatt och ~02:00 svensk tid
+function localIsoDate(d) {
+  const pad = n => String(n).padStart(2, "0");
+  return `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())}`;
+}
+
+function sortByStatus(items) {
+  const now = new Date();
+  const today = localIsoDate(now);
+  const soon = localIsoDate(new Date(now.getFullYear(), now.getMonth(), now.getDate() + 2));
+  return items.sort((a, b) =>
+    statusRank(a, today, soon) - statusRank(b, today, soon)
+    || (a.expiry_date || "9999-12-31").localeCompare(b.expiry_date || "9999-12-31")
+    || (a.name || "").localeCompare(b.name || "", "sv", { sensitivity: "base" }));
+}
 
 // Plattformsdetektering
 const IS_IOS = /iPad|iPhone|iPod/.test(navigator.userAgent) && !window.MSStream;
@@ -215,6 +276,14 @@ class GroceryScannerCard extends HTMLElement {
     this._cameraWorks = null;  // null=okänt, true/false efter test
     this._locationFilter = "all";
     this._editingExpiryId = null;
+    this._items = [];           // aktuell sida från grocery_query_items
+    this._itemsKey = null;      // filter + limit vid senaste hämtning
+    this._itemsSeq = 0;         // löpnummer – bara senaste hämtningen får skriva
+    this._rev = null;           // lagerrevision som _items motsvarar
+    this._resyncTimer = null;
+    this._unsubChanged = null;  // Promise<unsubscribe> för grocery_inventory_changed
+    this._changesDenied = false; // prenumeration nekad (icke-admin) – bara revisionsstyrd omhämtning
+    this._itemsLimit = INVENTORY_PAGE_SIZE;
   }
 
   static getConfigElement() { return document.createElement("div"); }
@@ -236,7 +305,25 @@ class GroceryScannerCard extends HTMLElement {
 
   set hass(hass) {
     this._hass = hass;
-    if (this._tab === "inventory") this._renderInventory();
+    this._subscribeChanges();
+    if (this._tab === "inventory") this._syncItems();
+  }
+
+  connectedCallback() { if (this._hass) this._subscribeChanges(); }
+
+  // HA tillåter bara admin-användare att prenumerera på egna händelsetyper.
+  // Nekas vi försöker vi inte igen (hass-settern körs vid varje tillståndsändring)
+  // utan _syncItems hämtar om när sensorns revision går förbi vår.
+  _subscribeChanges() {
+    if (this._unsubChanged || this._changesDenied || !this._hass?.connection) return;
+    if (this._hass.user && !this._hass.user.is_admin) { this._changesDenied = true; return; }
+    this._unsubChanged = this._hass.connection
+      .subscribeEvents(ev => this._applyChange(ev.data), "grocery_inventory_changed")
+      .catch(e => {
+        console.warn("[GroceryCard] subscribeEvents nekad – hämtar om vid ny revision:", e);
+        this._changesDenied = true;
+        this._unsubChanged = null;
+      });
   }
 
   // ── Bygg shadow DOM ────────────────────────────────────────────────────────
@@ -467,22 +554,10 @@ class GroceryScannerCard extends HTMLElement {
     this._product = null;
     this._scanState = "confirm";
 
-    // Produktlookup mot Open Food Facts
-    try {
-      const resp = await fetch(OFF_API.replace("{barcode}", barcode), { headers: OFF_HEADERS });
-      if (resp.ok) {
-        const data = await resp.json();
-        if (data.status === 1) {
-          const p = data.product;
-          this._product = {
-            name: p.product_name_sv || p.product_name || p.product_name_en || "",
-            brands: p.brands || "",
-            category: (p.categories_tags || []).slice(-1)[0]?.replace(/^en:/, "").replace(/-/g, " ") || "",
-            image_url: p.image_small_url || "",
-          };
-        }
-      }
-    } catch {}
+    // Produktlookup via pyscript (OFF + serverns cache) – grocery_scan_add
+    // träffar sedan samma cache, så skanningen kostar högst ett OFF-anrop
+    const res = await this._callServiceResponse("grocery_lookup_product", { barcode });
+    if (res?.found) this._product = res;
 
     const content = this._card.querySelector("#tab-content");
     if (content) this._renderConfirm(content);
@@ -647,58 +722,99 @@ class GroceryScannerCard extends HTMLElement {
   }
 
   // ── LAGER-fliken ──────────────────────────────────────────────────────────
-  _renderInventoryTab(container) { this._renderInventory(container); }
+  _renderInventoryTab(container) {
+    this._renderInventory(container);
+    this._syncItems(true);
+  }
+
+  // Hämta aktuell sida när filtret ändrats, eller när sensorns revision gått förbi
+  // vår och ingen patch kommit inom PATCH_GRACE_MS. Filtrering och sortering
+  // (utgångna → snart utgångna → lågt lager) sker i pyscript.
+  async _syncItems(force = false) {
+    const rev = this._hass?.states?.["sensor.grocery_total_items"]?.attributes?.revision ?? 0;
+    const key = `${this._locationFilter}|${this._itemsLimit}`;
+    if (!force && key === this._itemsKey) {
+      if (this._rev !== null && rev <= this._rev) return;
+      if (this._unsubChanged) {
+        clearTimeout(this._resyncTimer);
+        this._resyncTimer = setTimeout(() => {
+          if (this._rev === null || rev > this._rev) this._syncItems(true);
+        }, PATCH_GRACE_MS);
+        return;
+      }
+    }
+    clearTimeout(this._resyncTimer);
+    this._itemsKey = key;
+    const seq = ++this._itemsSeq;
+    const res = await this._queryItems({
+      location: this._locationFilter === "all" ? null : this._locationFilter,
+      sort: "status",
+      limit: this._itemsLimit,
+      compact: true,
+    });
+    if (seq !== this._itemsSeq) return;  // nyare hämtning har startat
+    if (res) {
+      this._items = (res.items || []).map(row => decodeItem(row));
+      this._rev = res.revision ?? rev;
+    }
+    this._renderInventory();
+  }
+
+  // Tillämpa en patch från grocery_inventory_changed på den lokala sidan.
+  // Glapp i revisionen, reset eller ändringar som inte går att avgöra lokalt
+  // (okänd vara flyttad in i filtret på en ofullständig sida) → hämta om.
+  _applyChange(patch) {
+    if (!patch || this._rev === null || patch.revision <= this._rev) return;
+    if (patch.reset || patch.revision !== this._rev + 1) { this._syncItems(true); return; }
+    this._rev = patch.revision;
+    clearTimeout(this._resyncTimer);
+
+    const loc = this._locationFilter;
+    const matches = item => loc === "all" || (item.location || "kyl") === loc;
+    const partial = this._items.length >= this._itemsLimit;
+    const removed = new Set(patch.removed || []);
+    let items = this._items.filter(i => !removed.has(i.id));
+    const byId = new Map(items.map(i => [i.id, i]));
+
+    for (const [id, row] of Object.entries(patch.updated || {})) {
+      const item = byId.get(id);
+      if (item) { Object.assign(item, decodeFields(row)); continue; }
+      if (partial || decodeFields(row).location === loc) { this._syncItems(true); return; }
+    }
+    for (const row of patch.added || []) {
+      const item = decodeItem(row);
+      if (matches(item)) items.push(item);
+    }
+    items = sortByStatus(items.filter(matches)).slice(0, this._itemsLimit);
+    this._items = items;
+    if (this._tab === "inventory") this._renderInventory();
+  }
 
   _renderInventory(container) {
     const c = container || this._card.querySelector("#tab-content");
     if (!c || this._tab !== "inventory") return;
-    const allItems = this._getItems();
+    const items = this._items;
     const today = new Date(); today.setHours(0, 0, 0, 0);
     const soon  = new Date(today); soon.setDate(soon.getDate() + 2);
 
-    if (!allItems.length) {
+    // Räkna per plats för filterknappar (publiceras av grocery_tracker.py)
+    const counts = { all: this._getTotalCount() };
+    for (const loc of ["kyl","frys","skafferi"]) {
+      counts[loc] = parseInt(this._hass?.states?.[`sensor.grocery_location_${loc}`]?.state || "0");
+    }
+
+    if (!counts.all) {
       c.innerHTML = `
         <div class="loc-filter">
           ${["all","kyl","frys","skafferi"].map(l => `<button class="loc-btn${this._locationFilter===l?" active":""}" data-loc="${l}">${this._locationLabel(l)}</button>`).join("")}
         </div>
         <div class="empty">📭 Lagret är tomt<br><small>Skanna eller lägg till manuellt</small></div>`;
       c.querySelectorAll(".loc-btn").forEach(btn => btn.addEventListener("click", () => {
-        this._locationFilter = btn.dataset.loc; this._renderInventory();
+        this._setLocationFilter(btn.dataset.loc);
       }));
       return;
     }
 
-    // Filtrera på plats
-    const items = this._locationFilter === "all"
-      ? allItems
-      : allItems.filter(i => (i.location || "kyl") === this._locationFilter);
-
-    // Sortera: utgångna → snart utgångna → lågt lager → normalt
-    const sorted = [...items].sort((a, b) => {
-      const rank = item => {
-        const exp = item.expiry_date ? new Date(item.expiry_date) : null;
-        if (exp) exp.setHours(0,0,0,0);
-        if (exp && exp < today) return 0;
-        if (exp && exp <= soon) return 1;
-        const minQ = item.min_quantity || 0;
-        if (minQ > 0 && item.quantity <= minQ) return 2;
-        return 3;
-      };
-      const ra = rank(a), rb = rank(b);
-      if (ra !== rb) return ra - rb;
-      const ea = a.expiry_date ? new Date(a.expiry_date) : null;
-      const eb = b.expiry_date ? new Date(b.expiry_date) : null;
-      if (ea && eb) return ea - eb;
-      if (ea) return -1; if (eb) return 1;
-      return (a.name || "").localeCompare(b.name || "", "sv");
-    });
-
-    // Räkna per plats för filterknappar
-    const counts = { all: allItems.length };
-    for (const loc of ["kyl","frys","skafferi"]) {
-      counts[loc] = allItems.filter(i => (i.location || "kyl") === loc).length;
-    }
-
     c.innerHTML = `
       <div class="loc-filter">
         ${["all","kyl","frys","skafferi"].map(l => `
@@ -707,11 +823,11 @@ class GroceryScannerCard extends HTMLElement {
           </button>`).join("")}
       </div>
       <div style="font-size:.85em;color:var(--secondary-text-color);margin-bottom:8px">
-        ${items.length} varor${this._locationFilter !== "all" ? " i " + this._locationLabel(this._locationFilter) : " i lager"}
+        ${counts[this._locationFilter]} varor${this._locationFilter !== "all" ? " i " + this._locationLabel(this._locationFilter) : " i lager"}
       </div>
-      ${sorted.length === 0
+      ${items.length === 0
         ? `<div class="empty">Inga varor här ännu</div>`
-        : sorted.map(item => {
+        : items.map(item => {
           const exp = item.expiry_date ? new Date(item.expiry_date) : null;
           if (exp) exp.setHours(0, 0, 0, 0);
           let cls = "", expTxt = "";
@@ -754,12 +870,17 @@ class GroceryScannerCard extends HTMLElement {
               </div>` : ""}
             </div>`;
         }).join("")}
+      ${items.length < counts[this._locationFilter]
+        ? `<button class="btn btn-outline btn-full" id="more-btn">Visa fler (${counts[this._locationFilter] - items.length} kvar)</button>`
+        : ""}
     `;
 
     c.querySelectorAll(".loc-btn").forEach(btn => {
-      btn.addEventListener("click", () => {
-        this._locationFilter = btn.dataset.loc; this._renderInventory();
-      });
+      btn.addEventListener("click", () => this._setLocationFilter(btn.dataset.loc));
+    });
+    c.querySelector("#more-btn")?.addEventListener("click", () => {
+      this._itemsLimit += INVENTORY_PAGE_SIZE;
+      this._syncItems();
     });
     c.querySelectorAll(".expiry-btn").forEach(btn => {
       btn.addEventListener("click", () => {
@@ -804,7 +925,29 @@ class GroceryScannerCard extends HTMLElement {
     catch (e) { console.error(`[GroceryCard] pyscript.${service}:`, e); }
   }
 
-  _getItems()             { return this._hass?.states?.["sensor.grocery_total_items"]?.attributes?.items || []; }
+  async _callServiceResponse(service, data) {
+    if (!this._hass) return null;
+    try {
+      const res = await this._hass.callWS({
+        type: "call_service", domain: "pyscript", service,
+        service_data: data, return_response: true,
+      });
+      return res?.response || null;
+    } catch (e) {
+      console.error(`[GroceryCard] pyscript.${service}:`, e);
+      return null;
+    }
+  }
+
+  _queryItems(data) { return this._callServiceResponse("grocery_query_items", data); }
+
+  _setLocationFilter(loc) {
+    this._locationFilter = loc;
+    this._itemsLimit = INVENTORY_PAGE_SIZE;
+    this._syncItems();
+  }
+
+  _getTotalCount()        { return parseInt(this._hass?.states?.["sensor.grocery_total_items"]?.state || "0"); }
   _getExpiringSoonCount() { return parseInt(this._hass?.states?.["sensor.grocery_expiring_soon"]?.state || "0"); }
   _getExpiredCount()      { return parseInt(this._hass?.states?.["sensor.grocery_expired"]?.state || "0"); }
   _getLowStockCount()     { return parseInt(this._hass?.states?.["sensor.grocery_low_stock"]?.state || "0"); }
@@ -848,7 +991,14 @@ class GroceryScannerCard extends HTMLElement {
     if (this._animFrame) { cancelAnimationFrame(this._animFrame); this._animFrame = null; }
     if (this._stream)    { this._stream.getTracks().forEach(t => t.stop()); this._stream = null; }
   }
-  disconnectedCallback() { this._stopCamera(); }
+  disconnectedCallback() {
+    this._stopCamera();
+    clearTimeout(this._resyncTimer);
+    if (this._unsubChanged) {
+      this._unsubChanged.then(unsub => unsub && unsub());
+      this._unsubChanged = null;
+    }
+  }
 }
 
 customElements.define("grocery-scanner-card", GroceryScannerCard);